@@ -6,6 +6,10 @@ import mimetypes
 from binder import bind_api
 from error import WeibopError
 from parser import ModelParser
+from coalesce import SingleFlight
+from compress import TransferStats
+from pool import ConnectionPool
+from retry import default_budget
 
 
 class API(object):
@@ -20,9 +24,21 @@ class API(object):
             retry_count=0,
             retry_delay=0,
             retry_errors=None,
+            retry_max_delay=60,
+            retry_budget=None,
             source=None,
             parser=None,
-            log=None
+            log=None,
+            pool=None,
+            pool_maxsize=10,
+            pool_idle_timeout=60,
+            connect_timeout=10,
+            read_timeout=30,
+            deadline=None,
+            compression=True,
+            coalesce=False,
+            cache=None,
+            identity_map=None,
         ):
         self.access_token = access_token
         self.client_secret=app_secret
@@ -34,14 +50,31 @@ class API(object):
         self.retry_count = retry_count
         self.retry_delay = retry_delay
         self.retry_errors = retry_errors
+        self.retry_max_delay = retry_max_delay
+        self.retry_budget = retry_budget or default_budget
         self.parser = parser or ModelParser()
         self.log = log
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.compression = compression
+        self.transfer_stats = TransferStats()
+        if coalesce is True:
+            coalesce = SingleFlight()
+        self.singleflight = coalesce or None
+        self.cache = cache
+        self.identity_map = identity_map
+        self.pool = pool or ConnectionPool(
+            maxsize=pool_maxsize,
+            idle_timeout=pool_idle_timeout,
+        )
 
     """ emotions.json """
     emotions = bind_api(
         path = '/emotions.json',
         payload_type = 'emotion', payload_list = True,
-        allowed_param = []
+        allowed_param = [],
+        cache_ttl = 3600,
     )
 
     """ statuses/public_timeline """
@@ -159,7 +192,8 @@ class API(object):
     get_status = bind_api(
         path = '/statuses/show.json',
         payload_type = 'status',
-        allowed_param = ['id']
+        allowed_param = ['id'],
+        cache_ttl = 300,
     )
 
     """ statuses/update """
@@ -303,7 +337,8 @@ class API(object):
     get_user = bind_api(
         path = '/users/show.json',
         payload_type = 'user',
-        allowed_param = ['id', 'user_id', 'screen_name', 'source', 'access_token']
+        allowed_param = ['id', 'user_id', 'screen_name', 'source', 'access_token'],
+        cache_ttl = 300,
     )
     
     """ Get the authenticated user """
@@ -409,6 +444,7 @@ class API(object):
     statuses_show = bind_api(
         path = '/statuses/show.json',
         allowed_param = ['id', 'access_token', 'source'],
+        cache_ttl = 300,
     )
 
     """ friends/ids """
@@ -828,6 +864,7 @@ class API(object):
         path = '/short_url/share/counts.json',
         payload_type = 'json',
         allowed_param = ['url_short'],
+        cache_ttl = 300,
     )
 
     """trends/statuses"""
@@ -850,6 +887,7 @@ class API(object):
         payload_type = 'tags',
         payload_list = True,
         allowed_param = ['uid', 'count', 'page', 'access_token', 'source'],
+        cache_ttl = 600,
     )
 
     """ Internal use only """
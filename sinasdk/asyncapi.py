@@ -0,0 +1,101 @@
+# coding=utf8
+
+'''
+    concurrent client built from the same endpoint declarations as API
+'''
+import threading
+import types
+from multiprocessing.pool import ThreadPool
+
+from api import API
+from pool import ConnectionPool
+
+
+def _make_async(call):
+    '''
+        wrap an api method so that it is submitted to the worker pool and
+        returns an AsyncResult instead of blocking.
+
+        the method runs on the blocking view of the client, so methods
+        built on other methods (me, verify_credentials, ...) do not end up
+        waiting on AsyncResults of their own.
+    '''
+    def _async_call(api, *args, **kargs):
+        return api.workers.apply_async(call, (api.blocking, ) + args, kargs)
+
+    _async_call.__name__ = call.__name__
+    _async_call.__doc__ = call.__doc__
+    if hasattr(call, 'api_method'):
+        _async_call.api_method = call.api_method
+    if hasattr(call, 'pagination_mode'):
+        _async_call.pagination_mode = call.pagination_mode
+    return _async_call
+
+
+class AsyncAPI(API):
+    '''
+        every endpoint declared with bind_api on API is available here too,
+        but returns an AsyncResult right away. use `.get()` on it (or
+        `gather`) to wait for the parsed result.
+
+        the same goes for the hand-written public methods (upload,
+        verify_credentials, the list methods, ...). `blocking` is a plain
+        API view of the same client, for calls that should not go
+        through the pool.
+
+        `concurrency` caps the number of requests in flight; the client owns
+        a connection pool of the same size. the worker threads are only
+        started by the first call; use the client as a context manager,
+        or call `close`, to stop them.
+    '''
+
+    def __init__(self, access_token, app_secret, concurrency=100, **kargs):
+        kargs.setdefault('pool', ConnectionPool(maxsize=concurrency))
+        API.__init__(self, access_token, app_secret, **kargs)
+        self.concurrency = concurrency
+        self._workers = None
+        self._workers_lock = threading.Lock()
+        # same state, blocking methods
+        self.blocking = API.__new__(API)
+        self.blocking.__dict__ = self.__dict__
+
+    @property
+    def workers(self):
+        '''
+            the worker pool, started on first use.
+        '''
+        with self._workers_lock:
+            if self._workers is None:
+                self._workers = ThreadPool(self.concurrency)
+            return self._workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def gather(self, results, timeout=None):
+        '''
+            wait for a list of AsyncResult and return their values in order.
+        '''
+        return [r.get(timeout) for r in results]
+
+    def close(self):
+        '''
+            stop accepting requests, wait for the pending ones and close
+            the idle connections.
+        '''
+        with self._workers_lock:
+            workers, self._workers = self._workers, None
+        if workers is not None:
+            workers.close()
+            workers.join()
+        self.pool.clear()
+
+
+# every public method of API: the bind_api endpoints and the hand-written
+# ones alike
+for _name, _attr in API.__dict__.items():
+    if not _name.startswith('_') and isinstance(_attr, types.FunctionType):
+        setattr(AsyncAPI, _name, _make_async(_attr))
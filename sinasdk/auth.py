@@ -3,7 +3,7 @@ import urllib2
 import time
 from error import WeibopError
 from utils import build_parameters
-from utils import import_simplejson
+from utils import get_json_backend
 
 def _request_access_token(client_id, client_secret, code, redirect_uri=None):
     ''' 
@@ -57,7 +57,7 @@ def _http_call(url, authorization, **kw):
         send an http request and expect to return a json object if no error.
     '''     
 
-    json = import_simplejson()
+    json = get_json_backend()
     body = build_parameters(**kw)
     print body
     req = urllib2.Request(url, data=body)
@@ -65,7 +65,9 @@ def _http_call(url, authorization, **kw):
 
     resp = urllib2.urlopen(req)
     body = resp.read()
-    r = json.loads(body, object_hook=_obj_hook)
+    r = json.loads(body)
+    if isinstance(r, dict):
+        r = _obj_hook(r)
     if hasattr(r, 'error_code'):
         raise WeiboError(getattr(r, 'error', ''))
     return r
@@ -85,7 +87,8 @@ class JsonObject(dict):
 
 def _obj_hook(pairs):
     '''
-    convert json object to python object.
+    convert json object to python object. only the top level object of a
+    response is converted, the oauth2 responses are flat.
     '''
     o = JsonObject()
     for k, v in pairs.iteritems():
@@ -1,14 +1,26 @@
 # coding=utf8
 
+import hashlib
 import httplib
+import itertools
 import urllib
 import time
 import re
+import socket
 from error import WeibopError
+from error import WeibopTimeout
 from utils import convert_to_utf8_str
+from utils import compile_fields
+from compress import ACCEPT_ENCODING
+from compress import DecodingReader
+from retry import backoff_delay
+from retry import retry_after
 
 re_path_template = re.compile('{\w+}')
 
+# methods that may be sent again after a transport error
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 
 def bind_api(**config):
 
@@ -19,6 +31,7 @@ def bind_api(**config):
         payload_list = config.get('payload_list', False)
         allowed_param = config.get('allowed_param', [])
         method = config.get('method', 'GET')
+        cache_ttl = config.get('cache_ttl', 0)
 
         def __init__(self, api, args, kargs):
 
@@ -28,7 +41,18 @@ def bind_api(**config):
             self.retry_count = kargs.pop('retry_count', api.retry_count)
             self.retry_delay = kargs.pop('retry_delay', api.retry_delay)
             self.retry_errors = kargs.pop('retry_errors', api.retry_errors)
+            self.retry_max_delay = kargs.pop('retry_max_delay', api.retry_max_delay)
             self.headers = kargs.pop('headers', {})
+            self.connect_timeout, self.read_timeout = self.build_timeout(
+                kargs.pop('timeout', None))
+            self.deadline = kargs.pop('deadline', api.deadline)
+            self.stream = kargs.pop('stream', False)
+            if self.stream and not self.payload_list:
+                raise WeibopError(
+                    'stream=True needs a list endpoint: %s' % self.path)
+            self.payload_format = kargs.pop('payload_format', None)
+            self.field_names = kargs.pop('fields', None)
+            self.fields = compile_fields(self.field_names)
             self.api_root = api.api_root
             
             self.build_parameters(args, kargs)
@@ -38,6 +62,8 @@ def bind_api(**config):
 
             # set headers
             self.headers['Host'] = self.host
+            if api.compression:
+                self.headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
 
         def build_parameters(self, args, kargs):
             self.parameters = {}
@@ -56,6 +82,63 @@ def bind_api(**config):
                 self.parameters[k] = convert_to_utf8_str(arg)
 
 
+        def response_key(self):
+            '''
+                identifies requests that are bound to get the same response
+                body: same method, path, parameters and token.
+            '''
+            return (
+                self.method,
+                self.host,
+                self.api_root + self.path,
+                tuple(sorted(self.parameters.items())),
+                self.api.access_token,
+            )
+
+        def request_key(self):
+            '''
+                identifies requests that are bound to get the same result:
+                the same response, parsed the same way.
+            '''
+            return self.response_key() + (
+                self.payload_format,
+                tuple(sorted(self.field_names or ())),
+            )
+
+        def cache_key(self):
+            # the cache holds the raw body, parsed again on every hit, so
+            # fields= and payload_format= variants share an entry
+            return '%s:%s' % (
+                self.path,
+                hashlib.md5(repr(self.response_key())).hexdigest(),
+            )
+
+        def build_timeout(self, timeout):
+            if timeout is None:
+                return self.api.connect_timeout, self.api.read_timeout
+            if isinstance(timeout, tuple):
+                return timeout
+            return timeout, timeout
+
+        def should_retry(self, status):
+            if self.retry_errors:
+                return status in self.retry_errors
+            # 429: rate limited, nothing was done; Retry-After says when
+            return status >= 500 or status == 429
+
+        def idempotent(self):
+            '''
+                whether sending the request twice is harmless. a transport
+                error may hit after the server got the request, so only
+                these are retried on one.
+            '''
+            return self.method in IDEMPOTENT_METHODS
+
+        def request_error(self, e, url):
+            if isinstance(e, socket.timeout):
+                return WeibopTimeout('Request timed out: %s, url=%s' % (e, url))
+            return WeibopError('Failed to send request: %s' % e + "url=" + str(url) +",self.headers="+ str(self.headers))
+
         def build_path(self):
             for variable in re_path_template.findall(self.path):
                 name = variable.strip('{}')
@@ -72,6 +155,15 @@ def bind_api(**config):
                 self.path = self.path.replace(variable, value)
 
         def execute(self):
+            # Serve idempotent endpoints from the response cache
+            cache_key = None
+            if self.api.cache is not None and self.cache_ttl \
+                    and self.method == 'GET' and not self.stream:
+                cache_key = self.cache_key()
+                body = self.api.cache.get(cache_key)
+                if body is not None:
+                    return self.api.parser.parse(self, body)
+
             # Build the request URL
             url = self.api_root + self.path
             if self.api.source is not None:
@@ -89,40 +181,90 @@ def bind_api(**config):
                         self.post_data = urllib.urlencode(self.parameters)
 
             sTime = time.time()
+            if self.deadline is not None:
+                expires_at = sTime + self.deadline
+            pool = self.api.pool
+            budget = self.api.retry_budget
+            budget.deposit()
             retries_performed = 0
-            while retries_performed < self.retry_count + 1:
-                # Open connection
-                # FIXME: add timeout
-                conn = httplib.HTTPSConnection(self.host)
+            while True:
+                connect_timeout = self.connect_timeout
+                read_timeout = self.read_timeout
+                if self.deadline is not None:
+                    remaining = expires_at - time.time()
+                    if remaining <= 0:
+                        raise WeibopTimeout(
+                            'Deadline of %ss exceeded before attempt %d, url=%s'
+                            % (self.deadline, retries_performed + 1, url))
+                    connect_timeout = min(connect_timeout or remaining, remaining)
+                    read_timeout = min(read_timeout or remaining, remaining)
 
+                error = None
                 try:
-                    conn.request(
+                    conn, resp = pool.urlopen(
+                        self.host,
                         self.method,
                         url,
                         headers=self.headers,
                         body=self.post_data,
+                        connect_timeout=connect_timeout,
+                        read_timeout=read_timeout,
                     )
-
-                    resp = conn.getresponse()
+                    if self.stream and resp.status == 200:
+                        # the body is consumed lazily by stream_result
+                        break
+                    try:
+                        body = DecodingReader(resp, self.api.transfer_stats).read()
+                    except Exception:
+                        pool.discard(conn)
+                        raise
+                except (socket.error, httplib.HTTPException) as e:
+                    if not self.idempotent():
+                        raise self.request_error(e, url)
+                    # transient transport error, worth a retry
+                    error = e
                 except Exception as e:
-                    raise WeibopError('Failed to send request: %s' % e + "url=" + str(url) +",self.headers="+ str(self.headers))
-
-                # Exit request loop if non-retry error code
-                if self.retry_errors:
-                    if resp.status not in self.retry_errors: break
+                    raise self.request_error(e, url)
                 else:
-                    if resp.status == 200:
+                    pool.release(self.host, conn, resp)
+                    # Exit request loop if non-retry error code
+                    if not self.should_retry(resp.status):
                         break
-                    else:
-                        pass
+
+                wait = None
+                if error is None:
+                    wait = retry_after(resp)
+                    # Give up if the server asks for a longer wait than a
+                    # retry may take; its 429/503 is raised below
+                    if wait is not None and wait > self.retry_max_delay:
+                        break
+
+                # Give up when out of retries or out of retry budget
+                if retries_performed >= self.retry_count or not budget.withdraw():
+                    if error is not None:
+                        raise self.request_error(error, url)
+                    break
+
+                delay = backoff_delay(
+                    retries_performed, self.retry_delay, self.retry_max_delay)
+                delay = max(delay, wait or 0)
+
+                # Give up if the deadline cannot fit another attempt
+                if self.deadline is not None and \
+                        expires_at - time.time() <= delay:
+                    raise WeibopTimeout(
+                        'Deadline of %ss exceeded after %d attempts, url=%s'
+                        % (self.deadline, retries_performed + 1, url))
 
                 # Sleep before retrying request again
-                time.sleep(self.retry_delay)
+                time.sleep(delay)
                 retries_performed += 1
 
-            # If an error was returned, throw an exception
-            body = resp.read()
             self.api.last_response = resp
+            if self.stream and resp.status == 200:
+                return self.stream_result(conn, resp)
+
+            # If an error was returned, throw an exception
             if self.api.log is not None:
                 requestUrl = "URL:https://"+ self.host + url
                 eTime = '%.0f' % ((time.time() - sTime) * 1000)
@@ -142,14 +284,50 @@ def bind_api(**config):
             
             # Parse the response payload
             result = self.api.parser.parse(self, body)
-            conn.close()
+            if cache_key is not None:
+                self.api.cache.set(cache_key, body, self.cache_ttl)
 
             return result
 
+        def stream_result(self, conn, resp):
+            '''
+                an iterator over the parsed items of a list payload, read
+                from the socket one at a time.
+
+                the first item is read right away: from then on the
+                generator is inside its try block, so if the caller drops
+                the iterator early, or never uses it, closing the generator
+                discards the connection instead of leaking it.
+            '''
+            items = self._stream_items(conn, resp)
+            try:
+                first = next(items)
+            except StopIteration:
+                return iter(())
+            return itertools.chain((first, ), items)
+
+        def _stream_items(self, conn, resp):
+            reader = DecodingReader(resp, self.api.transfer_stats)
+            try:
+                for item in self.api.parser.parse_stream(self, reader):
+                    yield item
+                # drain what follows the list so the connection can be reused
+                while reader.read(reader.chunk_size):
+                    pass
+            except BaseException:
+                self.api.pool.discard(conn)
+                raise
+            self.api.pool.release(self.host, conn, resp)
+
     def _call(api, *args, **kargs):
         method = APIMethod(api, args, kargs)
+        if api.singleflight is not None and method.method == 'GET' \
+                and not method.stream:
+            return api.singleflight.do(method.request_key(), method.execute)
         return method.execute()
 
+    _call.api_method = APIMethod
+
 
     # Set pagination mode
     if 'cursor' in APIMethod.allowed_param:
@@ -0,0 +1,105 @@
+# coding=utf8
+
+'''
+    response caches for idempotent GET endpoints
+'''
+import threading
+import time
+from collections import OrderedDict
+
+
+class Cache(object):
+    '''
+        cache interface. implement get/set/delete on top of any store
+        (memcached, redis, ...) and pass an instance as API(cache=...).
+
+        keys are short ascii strings and values are response bodies (str).
+    '''
+
+    def get(self, key):
+        '''
+            return the cached value or None
+        '''
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        '''
+            store `value` for `ttl` seconds
+        '''
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class MemoryCache(Cache):
+    '''
+        in-process TTL + LRU cache, bounded both by number of entries and by
+        total size of the cached bodies in bytes.
+    '''
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                self.size -= len(value)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            # most recently used goes last
+            self._entries[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self._entries[key] = (value, time.time() + ttl)
+            self.size += len(value)
+            while self.size > self.max_bytes or \
+                    len(self._entries) > self.max_entries:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[0])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self.size,
+        }
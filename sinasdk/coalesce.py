@@ -0,0 +1,57 @@
+# coding=utf8
+
+'''
+    singleflight: coalesce identical in-flight requests
+'''
+import sys
+import threading
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    '''
+        runs at most one call per key at a time. callers that ask for a key
+        which is already in flight wait for that call and share its result
+        (or its exception) instead of running their own.
+    '''
+
+    def __init__(self):
+        self.calls = 0
+        self.hits = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kargs):
+        with self._lock:
+            call = self._inflight.get(key)
+            if call is None:
+                call = _Call()
+                self._inflight[key] = call
+                self.calls += 1
+                leader = True
+            else:
+                self.hits += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn(*args, **kargs)
+            except Exception:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                call.event.set()
+        else:
+            call.event.wait()
+
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
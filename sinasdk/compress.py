@@ -0,0 +1,111 @@
+# coding=utf8
+
+'''
+    gzip/deflate response decoding
+'''
+import threading
+import zlib
+
+ACCEPT_ENCODING = 'gzip, deflate'
+
+
+class TransferStats(object):
+    '''
+        bytes received on the wire versus bytes after decoding.
+    '''
+
+    def __init__(self):
+        self.wire_bytes = 0
+        self.decoded_bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, wire_bytes, decoded_bytes):
+        with self._lock:
+            self.wire_bytes += wire_bytes
+            self.decoded_bytes += decoded_bytes
+
+    @property
+    def ratio(self):
+        '''
+            decoded bytes per wire byte.
+        '''
+        if not self.wire_bytes:
+            return 1.0
+        return float(self.decoded_bytes) / self.wire_bytes
+
+
+class _DeflateDecoder(object):
+    '''
+        `deflate` is zlib-wrapped per the RFC, but some servers send a raw
+        deflate stream. pick the right one from the first chunk.
+    '''
+
+    def __init__(self):
+        self._obj = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._obj.decompress(data)
+        self._first = False
+        try:
+            return self._obj.decompress(data)
+        except zlib.error:
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._obj.decompress(data)
+
+    def flush(self):
+        return self._obj.flush()
+
+
+def _get_decoder(encoding):
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return _DeflateDecoder()
+    return None
+
+
+class DecodingReader(object):
+    '''
+        file-like reader over an httplib response that undoes the
+        Content-Encoding chunk by chunk as the body is read.
+    '''
+
+    chunk_size = 16 * 1024
+
+    def __init__(self, resp, stats=None):
+        self._resp = resp
+        self._stats = stats
+        self._decoder = _get_decoder(resp.getheader('content-encoding'))
+        self._buffer = ''
+        self._eof = False
+
+    def _fill(self):
+        raw = self._resp.read(self.chunk_size)
+        if not raw:
+            self._eof = True
+            data = self._decoder.flush() if self._decoder else ''
+        elif self._decoder is not None:
+            data = self._decoder.decompress(raw)
+        else:
+            data = raw
+        if self._stats is not None:
+            self._stats.add(len(raw), len(data))
+        return data
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while not self._eof and (size < 0 or length < size):
+            data = self._fill()
+            chunks.append(data)
+            length += len(data)
+
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
@@ -0,0 +1,168 @@
+# coding=utf8
+
+'''
+    resumable, checkpointed crawls over paginated endpoints
+'''
+import os
+import struct
+
+import serialize
+from cursor import Cursor
+from cursor import page_items
+from error import WeibopError
+
+CHECKPOINT_VERSION = 2
+# length of each page record in the item log
+_record = struct.Struct('<I')
+
+
+class CrawlJob(object):
+    '''
+        crawl every page of a paginated api call (followers_ids,
+        friends_ids, followers, friends, direct_messages, ...) and keep
+        a checkpoint file at `path`.
+
+        the items of each page are appended to a log next to it
+        (`path`.items), so a checkpoint only holds the call, the next
+        cursor (or page), the counters and how much of the log they
+        cover. it is rewritten atomically every `every` pages, when the
+        crawl ends and when it fails. a job created on an existing
+        checkpoint cuts the log back to what it covers and resumes from
+        it; a finished one returns its results without sending any
+        request.
+
+            job = CrawlJob(api, 'followers_ids', '/tmp/1234.crawl', uid=1234)
+            ids = job.run()
+    '''
+
+    def __init__(self, api, method_name, path, every=10, **params):
+        self.api = api
+        self.method_name = method_name
+        self.method = getattr(api, method_name)
+        self.path = path
+        self.log_path = path + '.items'
+        self.log_size = 0
+        self.every = every
+        self.params = params
+        self.position = None
+        self.pages = 0
+        self.done = False
+        self.results = []
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        f = open(self.path, 'rb')
+        try:
+            state = serialize.loads(f.read(), self.api)
+        finally:
+            f.close()
+        if state.get('version') != CHECKPOINT_VERSION:
+            raise WeibopError('Unsupported checkpoint: %s' % self.path)
+        if state['method'] != self.method_name or state['params'] != self.params:
+            raise WeibopError(
+                'Checkpoint %s belongs to another crawl: %s %r' % (
+                    self.path, state['method'], state['params']))
+        self.position = state['position']
+        self.pages = state['pages']
+        self.done = state['done']
+        self.log_size = state['log_size']
+        self.results = self._read_log()
+
+    def _read_log(self):
+        '''
+            the items of the pages the checkpoint covers. anything logged
+            after it is left out, those pages are fetched again.
+        '''
+        results = []
+        if not self.log_size:
+            return results
+        f = open(self.log_path, 'rb')
+        try:
+            data = f.read(self.log_size)
+        finally:
+            f.close()
+        if len(data) < self.log_size:
+            raise WeibopError('Crawl log is shorter than its checkpoint: %s'
+                              % self.log_path)
+        pos = 0
+        while pos < len(data):
+            size = _record.unpack_from(data, pos)[0]
+            pos += _record.size
+            results.extend(serialize.loads(data[pos:pos + size], self.api))
+            pos += size
+        return results
+
+    def save(self, log=None):
+        '''
+            write the checkpoint: to a temporary file first, then renamed
+            over the old one, so a crash never leaves a torn checkpoint.
+            `log` is synced before, so the checkpoint never covers items
+            that are not on disk.
+        '''
+        if log is not None:
+            log.flush()
+            os.fsync(log.fileno())
+        data = serialize.dumps({
+            'version': CHECKPOINT_VERSION,
+            'method': self.method_name,
+            'params': self.params,
+            'position': self.position,
+            'pages': self.pages,
+            'done': self.done,
+            'log_size': self.log_size,
+        })
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+    def run(self, limit=None):
+        '''
+            fetch up to `limit` more pages (all remaining by default) and
+            return every item collected so far. errors are raised after
+            the progress up to the failing page has been saved.
+        '''
+        if self.done:
+            return self.results
+
+        params = dict(self.params)
+        if self.position is not None:
+            params[self.method.pagination_mode] = self.position
+        cursor = Cursor(self.method, **params)
+
+        log = open(self.log_path, 'ab')
+        since_save = 0
+        try:
+            # drop pages logged after the checkpoint
+            log.truncate(self.log_size)
+            for page in cursor.pages(limit):
+                items = page_items(page)
+                data = serialize.dumps(items)
+                log.write(_record.pack(len(data)))
+                log.write(data)
+                self.log_size += _record.size + len(data)
+                self.results.extend(items)
+                self.position = cursor.position
+                self.pages += 1
+                since_save += 1
+                if self.position is None:
+                    break
+                if since_save >= self.every:
+                    self.save(log)
+                    since_save = 0
+            # a short or empty page, or a 0 cursor, ends the crawl; a page
+            # limit only pauses it
+            if cursor.position is None:
+                self.done = True
+        finally:
+            try:
+                self.save(log)
+            finally:
+                log.close()
+        return self.results
@@ -0,0 +1,184 @@
+# coding=utf8
+
+'''
+    lazy pagination over the endpoints declared with bind_api
+'''
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from error import WeibopError
+from parser import LIST_KEYS
+
+
+def page_items(page):
+    '''
+        the list of items of one page: the page itself for list payloads,
+        otherwise its first list-valued key (`ids`, `users`, ...).
+    '''
+    if isinstance(page, list):
+        return page
+    for key in LIST_KEYS:
+        if isinstance(page, dict):
+            value = page.get(key)
+        else:
+            value = getattr(page, key, None)
+        if isinstance(value, list):
+            return value
+    return []
+
+
+def next_cursor(page):
+    if isinstance(page, dict):
+        return page.get('next_cursor')
+    return getattr(page, 'next_cursor', None)
+
+
+class Cursor(object):
+    '''
+        iterate over every page, or every item, of a paginated api call:
+
+            for uid in Cursor(api.followers_ids, uid=1).items():
+                ...
+
+        the mode comes from the `pagination_mode` bind_api sets on the
+        call. cursor mode follows `next_cursor` (or advances the cursor by
+        the page size when the server does not send one) and ends on a 0
+        cursor or an empty page. page mode counts pages up from `page` and
+        ends on an empty page, or a short one when `count` (`per_page`)
+        is given.
+
+        nothing is fetched before iterating and only one page is held at
+        a time. while iterating, `position` is the cursor (or page number)
+        the next page will be requested with, and None once the end has
+        been seen; pass it back as `cursor=` (`page=`) to resume.
+    '''
+
+    def __init__(self, method, *args, **kargs):
+        self.mode = getattr(method, 'pagination_mode', None)
+        if self.mode not in ('cursor', 'page'):
+            raise WeibopError('This method does not support pagination')
+        self.method = method
+        self.args = args
+        self.kargs = kargs
+        self.position = kargs.get(self.mode, 0 if self.mode == 'cursor' else 1)
+
+    def pages(self, limit=None):
+        '''
+            yield up to `limit` pages, all of them by default.
+        '''
+        if self.mode == 'cursor':
+            return self._cursor_pages(limit)
+        return self._page_pages(limit)
+
+    def items(self, limit=None):
+        '''
+            yield up to `limit` items, all of them by default.
+        '''
+        n = 0
+        for page in self.pages():
+            for item in page_items(page):
+                if limit is not None and n >= limit:
+                    return
+                yield item
+                n += 1
+            if limit is not None and n >= limit:
+                return
+
+    def _cursor_pages(self, limit):
+        kargs = dict(self.kargs)
+        cursor = kargs.pop('cursor', 0)
+        n = 0
+        while limit is None or n < limit:
+            page = self.method(*self.args, cursor=cursor, **kargs)
+            items = page_items(page)
+            if not items:
+                self.position = None
+                return
+            following = next_cursor(page)
+            if following is None:
+                following = cursor + len(items)
+            elif not following:
+                following = None
+            self.position = following
+            yield page
+            n += 1
+            if following is None:
+                return
+            cursor = following
+
+    def _page_pages(self, limit):
+        kargs = dict(self.kargs)
+        page_no = kargs.pop('page', 1)
+        count = kargs.get('count', kargs.get('per_page'))
+        n = 0
+        while limit is None or n < limit:
+            page = self.method(*self.args, page=page_no, **kargs)
+            items = page_items(page)
+            if not items:
+                self.position = None
+                return
+            short = count is not None and len(items) < int(count)
+            self.position = None if short else page_no + 1
+            yield page
+            n += 1
+            if short:
+                return
+            page_no += 1
+
+
+class PrefetchCursor(Cursor):
+    '''
+        a Cursor that keeps up to `depth` requests in flight on a worker
+        pool for page-mode endpoints, instead of waiting for each page
+        before asking for the next one. pages still come out in order.
+
+        no new page is requested once a page shows the end, so at most
+        depth - 1 requests are spent past it. `capacity`, when given, is
+        called before each request and returns how many more requests the
+        rate limit allows; the number in flight never exceeds it.
+
+        cursor-mode endpoints only learn the next cursor from the previous
+        page and are iterated sequentially.
+    '''
+
+    def __init__(self, method, *args, **kargs):
+        self.depth = kargs.pop('depth', 4)
+        self.capacity = kargs.pop('capacity', None)
+        Cursor.__init__(self, method, *args, **kargs)
+
+    def _window(self):
+        if self.capacity is None:
+            return self.depth
+        # always allow one request, so that the limiter itself reports
+        # running out instead of the cursor stopping silently
+        return max(1, min(self.depth, self.capacity()))
+
+    def _page_pages(self, limit):
+        kargs = dict(self.kargs)
+        page_no = self.position = kargs.pop('page', 1)
+        count = kargs.get('count', kargs.get('per_page'))
+        issued = 0
+        pending = deque()
+        workers = ThreadPool(self.depth)
+        try:
+            while True:
+                while len(pending) < self._window() and \
+                        (limit is None or issued < limit):
+                    pending.append(workers.apply_async(
+                        self.method, self.args, dict(kargs, page=page_no)))
+                    page_no += 1
+                    issued += 1
+                if not pending:
+                    return
+                page = pending.popleft().get()
+                items = page_items(page)
+                if not items:
+                    self.position = None
+                    return
+                short = count is not None and len(items) < int(count)
+                self.position = None if short else self.position + 1
+                yield page
+                if short:
+                    return
+        finally:
+            workers.terminate()
@@ -12,3 +12,9 @@ class WeibopError(StandardError):
         
     def __str__(self):
         return self.reason.encode('utf8')
+
+
+class WeibopTimeout(WeibopError):
+    '''
+        raised when a request times out or runs past its deadline.
+    '''
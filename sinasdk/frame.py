@@ -0,0 +1,133 @@
+# coding=utf8
+
+'''
+    columnar result frames for bulk analytics
+'''
+from array import array
+from calendar import timegm
+
+from utils import INT64_TYPECODE
+from utils import parse_datetime
+from utils import require_int64
+
+Q = INT64_TYPECODE
+
+# weibo timestamps are in +0800
+_UTC_OFFSET = 8 * 3600
+
+
+def _epoch(value):
+    '''
+        weibo created_at string -> unix timestamp, 0 if missing.
+    '''
+    if not value:
+        return 0
+    return timegm(parse_datetime(value).timetuple()) - _UTC_OFFSET
+
+
+def _get(json, path):
+    for key in path:
+        if not isinstance(json, dict):
+            return None
+        json = json.get(key)
+    return json
+
+
+class Frame(object):
+    '''
+        a page of results stored column by column. numeric and timestamp
+        columns are int64 arrays (missing values are 0), text columns
+        are lists. rows are built on access as dicts.
+
+        subclasses declare `columns` as (name, typecode, json path, convert)
+        where typecode is Q (int64) or None for a text column.
+    '''
+
+    columns = ()
+
+    def __init__(self):
+        require_int64()
+        self._columns = {}
+        for name, typecode, path, convert in self.columns:
+            self._columns[name] = array(typecode) if typecode else []
+
+    @classmethod
+    def from_json(cls, items):
+        frame = cls()
+        appenders = [
+            (frame._columns[name].append, typecode, path, convert)
+            for name, typecode, path, convert in cls.columns
+        ]
+        for item in items:
+            for append, typecode, path, convert in appenders:
+                value = _get(item, path)
+                if convert is not None:
+                    value = convert(value)
+                if typecode and value is None:
+                    value = 0
+                append(int(value) if typecode else value)
+        return frame
+
+    def __len__(self):
+        return len(self._columns[self.columns[0][0]])
+
+    def __getitem__(self, index):
+        return dict(
+            (name, self._columns[name][index]) for name in self._columns)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    @property
+    def column_names(self):
+        return [c[0] for c in self.columns]
+
+    def column(self, name):
+        return self._columns[name]
+
+    def to_numpy(self, name):
+        '''
+            the column as a numpy array; numeric columns share the memory
+            of the underlying array.
+        '''
+        import numpy
+        values = self._columns[name]
+        if isinstance(values, array):
+            return numpy.frombuffer(values, dtype=numpy.int64)
+        return numpy.array(values, dtype=object)
+
+
+class StatusFrame(Frame):
+
+    columns = (
+        ('id', Q, ('id', ), None),
+        ('created_at', Q, ('created_at', ), _epoch),
+        ('author_id', Q, ('user', 'id'), None),
+        ('reposts_count', Q, ('reposts_count', ), None),
+        ('comments_count', Q, ('comments_count', ), None),
+        ('attitudes_count', Q, ('attitudes_count', ), None),
+        ('retweeted_id', Q, ('retweeted_status', 'id'), None),
+        ('text', None, ('text', ), None),
+        ('source', None, ('source', ), None),
+    )
+
+
+class CommentsFrame(Frame):
+
+    columns = (
+        ('id', Q, ('id', ), None),
+        ('created_at', Q, ('created_at', ), _epoch),
+        ('author_id', Q, ('user', 'id'), None),
+        ('status_id', Q, ('status', 'id'), None),
+        ('reply_comment_id', Q, ('reply_comment', 'id'), None),
+        ('text', None, ('text', ), None),
+        ('source', None, ('source', ), None),
+    )
+
+
+# payload_type -> frame class
+FRAMES = {
+    'status': StatusFrame,
+    'comments': CommentsFrame,
+}
@@ -0,0 +1,74 @@
+# coding=utf8
+
+'''
+    identity map: one object per user / status id
+'''
+import sys
+import threading
+import weakref
+
+
+class IdentityMap(object):
+    '''
+        dedupes parsed User and Status objects by (kind, id).
+
+        when an object with a known id is parsed again, the fields of the
+        new copy are merged into the object already in the map (newest
+        values win) and that object is returned instead. objects are held
+        through weak references, so the map never keeps them alive, and at
+        most `max_size` of them are tracked.
+
+        share one instance between API objects to scope it to a crawl.
+    '''
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.lookups = 0
+        self.hits = 0
+        self.saved_bytes = 0
+        self._objects = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def intern(self, kind, obj):
+        try:
+            key = (kind, obj.id)
+        except AttributeError:
+            return obj
+
+        with self._lock:
+            self.lookups += 1
+            existing = self._objects.get(key)
+            if existing is None:
+                if len(self._objects) < self.max_size:
+                    self._objects[key] = obj
+                return obj
+            self.hits += 1
+            self.saved_bytes += _object_size(obj)
+
+        _merge(existing, obj)
+        return existing
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+
+
+def _object_size(obj):
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is not None:
+        size += sys.getsizeof(attrs)
+    return size
+
+
+def _merge(existing, obj):
+    if hasattr(obj, '__dict__'):
+        fields = dict(obj.__dict__)
+    else:
+        fields = obj.__getstate__()
+    fields.pop('_api', None)
+    for k, v in fields.items():
+        setattr(existing, k, v)
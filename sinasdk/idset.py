@@ -0,0 +1,296 @@
+# coding=utf8
+
+'''
+    compact sets of 64-bit ids for follower/friend graphs
+'''
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from bisect import bisect_right
+from itertools import islice
+from itertools import izip
+
+from error import WeibopError
+from utils import INT64_TYPECODE
+from utils import require_int64
+
+MAGIC = 'WBID'
+VERSION = 1
+# magic, version, number of ids; the ids follow as little-endian int64
+_header = struct.Struct('<4sIQ')
+_item = struct.Struct('<q')
+
+
+def _merge_sorted(runs, batch=1 << 16):
+    '''
+        merge sorted, duplicate-free int64 arrays into one. works in
+        batches: everything up to the smallest of the runs' next `batch`-th
+        values is cut out with bisect, deduplicated and sorted at C speed,
+        so only about len(runs) * batch ids are ever held as python ints.
+    '''
+    out = array(INT64_TYPECODE)
+    starts = [0] * len(runs)
+    while True:
+        active = [i for i, run in enumerate(runs) if starts[i] < len(run)]
+        if not active:
+            return out
+        bound = min(runs[i][min(starts[i] + batch, len(runs[i])) - 1]
+                    for i in active)
+        chunk = set()
+        for i in active:
+            run = runs[i]
+            end = bisect_right(run, bound, starts[i])
+            chunk.update(run[starts[i]:end])
+            starts[i] = end
+        out.extend(sorted(chunk))
+
+
+class _MappedIds(object):
+    '''
+        read-only sequence over the ids of a file saved by IdSet.save,
+        decoded from the memory map on access. slices are copied out as
+        int64 arrays.
+    '''
+
+    def __init__(self, path):
+        f = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        magic, version, self._len = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise WeibopError('Not an id set file: %s' % path)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._len)
+            ids = array(INT64_TYPECODE)
+            if stop > start:
+                ids.fromstring(self._map[
+                    _header.size + 8 * start:_header.size + 8 * stop])
+                if sys.byteorder != 'little':
+                    ids.byteswap()
+            if step != 1:
+                ids = ids[::step]
+            return ids
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError('id set index out of range')
+        return _item.unpack_from(self._map, _header.size + 8 * i)[0]
+
+    def __iter__(self):
+        unpack = _item.unpack_from
+        data = self._map
+        for offset in xrange(_header.size, _header.size + 8 * self._len, 8):
+            yield unpack(data, offset)[0]
+
+    def close(self):
+        self._map.close()
+
+
+class IdSet(object):
+    '''
+        an immutable set of ids stored as a sorted array of int64, 8 bytes
+        per id. membership is a binary search; union, intersection and
+        difference merge the two sorted arrays.
+
+        build one from an iterable with IdSet(ids) or, to stream a crawl
+        without holding a list, with IdSetBuilder. `save` writes it to
+        disk and `load(path)` maps it back without reading the ids into
+        memory.
+    '''
+
+    def __init__(self, ids=()):
+        builder = IdSetBuilder()
+        builder.extend(ids)
+        self._ids = builder._merge()
+
+    @classmethod
+    def _from_sorted(cls, ids):
+        obj = cls.__new__(cls)
+        obj._ids = ids
+        return obj
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, uid):
+        ids = self._ids
+        i = bisect_left(ids, uid)
+        return i < len(ids) and ids[i] == uid
+
+    def __eq__(self, other):
+        return isinstance(other, IdSet) and len(self) == len(other) \
+            and all(a == b for a, b in izip(self, other))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<IdSet of %d ids>' % len(self)
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def union(self, other):
+        return IdSet._from_sorted(_merge_sorted([self._ids, other._ids]))
+
+    def intersection(self, other):
+        a, b = self._ids, other._ids
+        if len(a) > len(b):
+            a, b = b, a
+        # few probes into a large set: binary search beats a full merge
+        if len(a) * 16 < len(b):
+            return IdSet._from_sorted(array(
+                INT64_TYPECODE, (i for i in a if i in other)))
+        return IdSet._from_sorted(array(INT64_TYPECODE, self._merge_with(
+            other, lambda x, y: x == y)))
+
+    def difference(self, other):
+        return IdSet._from_sorted(array(INT64_TYPECODE, self._merge_with(
+            other, lambda x, y: x != y, keep_tail=True)))
+
+    def _merge_with(self, other, keep, keep_tail=False):
+        '''
+            walk both sorted sequences; yield x from self when keep(x, y)
+            where y is the smallest id of other that is >= x.
+        '''
+        others = iter(other._ids)
+        y = next(others, None)
+        for x in self._ids:
+            while y is not None and y < x:
+                y = next(others, None)
+            if y is None:
+                if keep_tail:
+                    yield x
+                continue
+            if keep(x, y):
+                yield x
+
+    def save(self, path):
+        '''
+            write the set to `path`, atomically.
+        '''
+        ids = self._ids
+        if not isinstance(ids, array):
+            ids = array(INT64_TYPECODE, ids)
+        if sys.byteorder != 'little':
+            ids = array(INT64_TYPECODE, ids)
+            ids.byteswap()
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(_header.pack(MAGIC, VERSION, len(ids)))
+            ids.tofile(f)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+
+    @classmethod
+    def load(cls, path, mapped=True):
+        '''
+            read a set saved with `save`. when `mapped` the file is
+            memory-mapped: the ids stay on disk and are paged in by the OS
+            as they are looked up.
+        '''
+        require_int64()
+        if mapped:
+            return cls._from_sorted(_MappedIds(path))
+        f = open(path, 'rb')
+        try:
+            magic, version, n = _header.unpack(f.read(_header.size))
+            if magic != MAGIC or version != VERSION:
+                raise WeibopError('Not an id set file: %s' % path)
+            ids = array(INT64_TYPECODE)
+            ids.fromfile(f, n)
+        finally:
+            f.close()
+        if sys.byteorder != 'little':
+            ids.byteswap()
+        return cls._from_sorted(ids)
+
+    def close(self):
+        '''
+            release the memory map of a set loaded with mapped=True.
+        '''
+        if isinstance(self._ids, _MappedIds):
+            self._ids.close()
+
+
+class IdSetBuilder(object):
+    '''
+        accumulate ids page by page, e.g. from Cursor.pages(), into an
+        IdSet. ids are kept in int64 arrays that are sorted and deduplicated
+        in runs of `run_size`, so memory stays near 8 bytes per id while
+        crawling.
+    '''
+
+    run_size = 1 << 16
+
+    def __init__(self):
+        require_int64()
+        self._runs = []
+        self._pending = array(INT64_TYPECODE)
+
+    def extend(self, ids):
+        if isinstance(ids, (list, tuple, array)):
+            # the usual case, a page of ids: slice instead of iterating
+            while ids:
+                room = self.run_size - len(self._pending)
+                self._pending.extend(array(INT64_TYPECODE, ids[:room]))
+                ids = ids[room:]
+                if len(self._pending) >= self.run_size:
+                    self._flush()
+            return
+        ids = iter(ids)
+        while True:
+            self._pending.extend(
+                islice(ids, self.run_size - len(self._pending)))
+            if len(self._pending) < self.run_size:
+                return
+            self._flush()
+
+    def add(self, uid):
+        self.extend((uid, ))
+
+    def _flush(self):
+        if self._pending:
+            self._runs.append(array(
+                INT64_TYPECODE, sorted(set(self._pending))))
+            self._pending = array(INT64_TYPECODE)
+
+    def _merge(self):
+        self._flush()
+        runs, self._runs = self._runs, []
+        if not runs:
+            return array(INT64_TYPECODE)
+        if len(runs) == 1:
+            return runs[0]
+        return _merge_sorted(runs)
+
+    def build(self):
+        '''
+            the IdSet of everything added so far; the builder is emptied.
+        '''
+        return IdSet._from_sorted(self._merge())
+
+    def __len__(self):
+        return sum(len(r) for r in self._runs) + len(self._pending)
@@ -7,13 +7,216 @@ from utils import parse_html_value
 from utils import parse_a_href
 from utils import parse_search_datetime
 from utils import unescape_html
+import sys
 
 class ResultSet(list):
     """A list like object that holds results from a Twitter API query."""
 
 
+def _intern(api, kind, obj):
+    """return the object already known for obj's id, if the api has an
+    identity map"""
+    identity_map = getattr(api, 'identity_map', None)
+    if identity_map is None:
+        return obj
+    return identity_map.intern(kind, obj)
+
+
+class Field(object):
+    """
+    Declares how one key of a payload is parsed: `model` (a Model class or
+    its name in the module of the declaring model) parses nested objects,
+    `convert` maps the value, `aliases` are extra attribute names for the
+    result and `handler(attrs, value)` takes over entirely; its aliases
+    are the other attributes it may set. Keys without a Field are copied
+    as they are.
+
+    A model name is looked up with the family prefix of the model being
+    parsed first, so the spec of Status gives CompactStatus a CompactUser
+    and LazyStatus a LazyUser.
+    """
+
+    def __init__(self, name, model=None, convert=None, aliases=(), handler=None):
+        self.name = name
+        self.model = model
+        self.convert = convert
+        self.aliases = aliases
+        self.handler = handler
+
+
+def _parse_created_at(v):
+    #fixme value of created_at maybe ''
+    return parse_datetime(v) if v else None
+
+
+def _is_true(v):
+    return v is True
+
+
+def _source_fields(attrs, v):
+    if '<' in v:
+        attrs['source'] = parse_html_value(v)
+        attrs['source_url'] = parse_a_href(v)
+
+
+def _spec_model(cls, model):
+    """the class for Field.model when parsing cls, compiled if needed"""
+    if isinstance(model, basestring):
+        # names are resolved where the spec was declared
+        for klass in cls.__mro__:
+            if 'field_spec' in klass.__dict__:
+                break
+        module = sys.modules[klass.__module__]
+        model = getattr(module, cls.family + model, None) or \
+            getattr(module, model)
+    if _needs_compile(model):
+        compile_parse(model)
+    return model
+
+
+def _field_lines(cls, namespace, store=None):
+    """
+    source lines converting the declared keys of `json`. by default the
+    results go into the dict `attrs`; store(name, expr) gives the line
+    that stores them otherwise.
+    """
+    lines = []
+    for i, field in enumerate(cls.field_spec):
+        key = repr(field.name)
+        lines.append('    if %s in json:' % key)
+        lines.append('        v = json[%s]' % key)
+        if field.model is not None:
+            namespace['_model%d' % i] = _spec_model(cls, field.model)
+            lines.append('        v = _model%d.parse(api, v)' % i)
+        if field.convert is not None:
+            namespace['_convert%d' % i] = field.convert
+            lines.append('        v = _convert%d(v)' % i)
+        names = (field.name, ) + tuple(field.aliases)
+        if field.handler is not None:
+            namespace['_handler%d' % i] = field.handler
+            if store is None:
+                lines.append('        _handler%d(attrs, v)' % i)
+                continue
+            lines.append('        h = {}')
+            lines.append('        _handler%d(h, v)' % i)
+            for name in names:
+                lines.append('        if %r in h:' % name)
+                lines.append('            ' + store(name, 'h[%r]' % name))
+            continue
+        for name in names:
+            if store is None:
+                lines.append('        attrs[%r] = v' % name)
+            else:
+                lines.append('        ' + store(name, 'v'))
+    return lines
+
+
+def _slot_setter(cls, name):
+    """the __set__ of the slot `name` of cls"""
+    for klass in cls.__mro__:
+        slot = klass.__dict__.get(name)
+        if type(slot) is _member_descriptor:
+            return slot.__set__
+    raise AttributeError(name)
+
+
+def _put_extra(obj, name, value):
+    extra = obj._extra
+    if extra is None:
+        extra = {}
+        object.__setattr__(obj, '_extra', extra)
+    extra[name] = value
+
+
+def _compact_lines(cls, namespace):
+    """
+    the body of a CompactModel parse: the payload goes straight into the
+    slots, only the keys without one are collected into _extra
+    """
+    namespace['_new'] = object.__new__
+    namespace['_fieldset'] = cls._fieldset
+    namespace['_put_extra'] = _put_extra
+    slots = {}
+
+    def setter(name):
+        if name not in slots:
+            slots[name] = '_slot%d' % len(slots)
+            namespace[slots[name]] = _slot_setter(cls, name)
+        return slots[name]
+
+    def store(name, expr):
+        if name in cls._fieldset:
+            return '%s(obj, %s)' % (setter(name), expr)
+        return '_put_extra(obj, %r, %s)' % (name, expr)
+
+    lines = [
+        '    obj = _new(cls)',
+        '    %s(obj, api)' % setter('_api'),
+        '    %s(obj, None)' % setter('_extra'),
+        '    rest = json.viewkeys() - _fieldset',
+        '    if rest:',
+        '        %s(obj, dict([(k, json[k]) for k in rest]))'
+        % setter('_extra'),
+    ]
+    # copied as they are; the keys a Field converts are set below
+    converted = frozenset(
+        f.name for f in cls.field_spec if f.handler is None)
+    for name in cls.fields:
+        if name not in converted:
+            lines.append('    if %r in json:' % name)
+            lines.append('        %s(obj, json[%r])' % (setter(name), name))
+    lines.extend(_field_lines(cls, namespace, store))
+    return lines
+
+
+def compile_parse(cls):
+    """
+    Generate cls.parse from cls.field_spec: the payload is copied into
+    the instance __dict__ in one go (into the slots for compact models),
+    then only the declared keys are converted. Models named by the spec
+    are compiled too; lazy models get their converters instead.
+    """
+    if issubclass(cls, LazyModel):
+        return _compile_lazy(cls)
+    # mark first: specs refer to their own model (retweeted_status)
+    cls._parse_source = None
+    namespace = {'_intern': _intern}
+    lines = ['def parse(cls, api, json):']
+    if issubclass(cls, CompactModel):
+        lines.extend(_compact_lines(cls, namespace))
+    else:
+        lines.append('    obj = cls(api)')
+        lines.append('    attrs = obj.__dict__')
+        lines.append('    attrs.update(json)')
+        lines.extend(_field_lines(cls, namespace))
+    if cls.kind is None:
+        lines.append('    return obj')
+    else:
+        lines.append('    return _intern(api, %r, obj)' % cls.kind)
+
+    source = '\n'.join(lines) + '\n'
+    exec compile(source, '<%s.parse>' % cls.__name__, 'exec') in namespace
+    cls.parse = classmethod(namespace['parse'])
+    cls._parse_source = source
+    return cls
+
+
+def _needs_compile(cls):
+    return isinstance(cls, type) and issubclass(cls, Model) and \
+        'field_spec' in cls.__dict__ and '_parse_source' not in cls.__dict__
+
+
 class Model(object):
 
+    # subclasses still get a __dict__ unless they declare __slots__ too
+    __slots__ = ()
+
+    # identity map kind, None to not intern instances
+    kind = None
+
+    # prefix of the model names a field_spec resolves to, see Field
+    family = ''
+
     def __init__(self, api=None):
         self._api = api
 
@@ -37,38 +240,10 @@ class Model(object):
         return results
 
 
-class Status(Model):
+class StatusMethods(object):
+    """Actions on a status, shared by Status and CompactStatus."""
 
-    @classmethod
-    def parse(cls, api, json):
-        status = cls(api)
-        for k, v in json.items():
-            if k == 'user':
-                user = User.parse(api, v)
-                setattr(status, 'author', user)
-                setattr(status, 'user', user)  # DEPRECIATED
-            elif k == 'screen_name':
-                setattr(status, k, v)
-            elif k == 'created_at':
-                #fixme value of created_at maybe ''
-                if v:
-                    setattr(status, k, parse_datetime(v))
-                else:
-                    print 'created_at is null string'
-                    setattr(status, k, None)
-            elif k == 'source':
-                if '<' in v:
-                    setattr(status, k, parse_html_value(v))
-                    setattr(status, 'source_url', parse_a_href(v))
-                else:
-                    setattr(status, k, v)
-            elif k == 'retweeted_status':
-                setattr(status, k, Status.parse(api, v))
-            elif k == 'geo':
-                setattr(status, k, Geo.parse(api, v))
-            else:
-                setattr(status, k, v)
-        return status
+    __slots__ = ()
 
     def destroy(self):
         return self._api.destroy_status(self.id)
@@ -81,6 +256,20 @@ class Status(Model):
 
     def favorite(self):
         return self._api.create_favorite(self.id)
+
+
+class Status(StatusMethods, Model):
+
+    kind = 'status'
+    field_spec = (
+        Field('user', model='User', aliases=('author', )),
+        Field('created_at', convert=_parse_created_at),
+        Field('source', handler=_source_fields, aliases=('source_url', )),
+        Field('retweeted_status', model='Status'),
+        Field('geo', model='Geo'),
+    )
+
+
 class Geo(Model):
 
     @classmethod
@@ -91,72 +280,20 @@ class Geo(Model):
                 setattr(geo, k, v)
         return geo
     
-class Comments(Model):
-
-    @classmethod
-    def parse(cls, api, json):
-        comments = cls(api)
-        for k, v in json.items():
-            if k == 'user':
-                user = User.parse(api, v)
-                setattr(comments, 'author', user)
-                setattr(comments, 'user', user)
-            elif k == 'status':
-                status = Status.parse(api, v)
-                setattr(comments, k, status)
-            elif k == 'created_at' and v:
-                setattr(comments, k, parse_datetime(v))
-            elif k == 'reply_comment':
-                setattr(comments, k, Comments.parse(api, v))
-            else:
-                setattr(comments, k, v)
-        return comments
-
-    def destroy(self):
-        return self._api.destroy_status(self.id)
-
-    def retweet(self):
-        return self._api.retweet(self.id)
-
-    def retweets(self):
-        return self._api.retweets(self.id)
-
-    def favorite(self):
-        return self._api.create_favorite(self.id)
+class Comments(StatusMethods, Model):
 
-class User(Model):
+    field_spec = (
+        Field('user', model='User', aliases=('author', )),
+        Field('status', model='Status'),
+        Field('created_at', convert=_parse_created_at),
+        Field('reply_comment', model='Comments'),
+    )
 
-    @classmethod
-    def parse(cls, api, json):
-        user = cls(api)
-        for k, v in json.items():
-            if k == 'created_at':
-                setattr(user, k, parse_datetime(v))
-            elif k == 'status':
-                setattr(user, k, Status.parse(api, v))
-            elif k == 'screen_name':
-                setattr(user, k, v)
-            elif k == 'following':
-                # twitter sets this to null if it is false
-                if v is True:
-                    setattr(user, k, True)
-                else:
-                    setattr(user, k, False)
-            else:
-                setattr(user, k, v)
-        return user
 
-    @classmethod
-    def parse_list(cls, api, json_list):
-        if isinstance(json_list, list):
-            item_list = json_list
-        else:
-            item_list = json_list['users']
+class UserMethods(object):
+    """Actions on a user, shared by User and CompactUser."""
 
-        results = ResultSet()
-        for obj in item_list:
-            results.append(cls.parse(api, obj))
-        return results
+    __slots__ = ()
 
     def timeline(self, **kargs):
         return self._api.user_timeline(user_id=self.id, **kargs)
@@ -188,28 +325,45 @@ class User(Model):
         return self._api.followers_ids(user_id=self.id, *args, **kargs)
 
 
+class User(UserMethods, Model):
 
+    kind = 'user'
+    field_spec = (
+        Field('created_at', convert=_parse_created_at),
+        Field('status', model='Status'),
+        # twitter sets this to null if it is false
+        Field('following', convert=_is_true),
+    )
 
-class DirectMessage(Model):
     @classmethod
-    def parse(cls, api, json):
-        dm = cls(api)
-        for k, v in json.items():
-            if k == 'sender' or k == 'recipient':
-                setattr(dm, k, User.parse(api, v))
-            elif k == 'created_at':
-                setattr(dm, k, parse_datetime(v))
-            else:
-                setattr(dm, k, v)
-        return dm
+    def parse_list(cls, api, json_list):
+        if isinstance(json_list, list):
+            item_list = json_list
+        else:
+            item_list = json_list['users']
+
+        results = ResultSet()
+        if item_list is not json_list:
+            results.next_cursor = json_list.get('next_cursor')
+            results.previous_cursor = json_list.get('previous_cursor')
+        for obj in item_list:
+            results.append(cls.parse(api, obj))
+        return results
+
+
+class DirectMessage(Model):
+
+    field_spec = (
+        Field('sender', model='User'),
+        Field('recipient', model='User'),
+        Field('created_at', convert=_parse_created_at),
+    )
+
 
 class Emotion(Model):
-    @classmethod
-    def parse(cls, api, json):
-        emotion = cls(api)
-        for k, v in json.items():
-            setattr(emotion, k, v)
-        return emotion 
+
+    field_spec = ()
+
 
 class Friendship(Model):
 
@@ -230,15 +384,9 @@ class Friendship(Model):
 
 class SavedSearch(Model):
 
-    @classmethod
-    def parse(cls, api, json):
-        ss = cls(api)
-        for k, v in json.items():
-            if k == 'created_at':
-                setattr(ss, k, parse_datetime(v))
-            else:
-                setattr(ss, k, v)
-        return ss
+    field_spec = (
+        Field('created_at', convert=_parse_created_at),
+    )
 
     def destroy(self):
         return self._api.destroy_saved_search(self.id)
@@ -338,20 +486,14 @@ class JSONModel(Model):
         return lst
 
 class IDSModel(Model):
-    @classmethod
-    def parse(cls, api, json):
-        ids = IDSModel(api)
-        for k, v in json.items():            
-            setattr(ids, k, v)
-        return ids
-    
+
+    field_spec = ()
+
+
 class Counts(Model):
-    @classmethod
-    def parse(cls, api, json):
-        ids = Counts(api)
-        for k, v in json.items():            
-            setattr(ids, k, v)
-        return ids
+
+    field_spec = ()
+
 
 class Tags(Model):
     @classmethod
@@ -360,13 +502,274 @@ class Tags(Model):
             lambda l1, l2: l1 + l2, 
             json.items())
     
+def _fill_slots(cls, obj, attrs):
+    """store parsed attrs in the slots of a CompactModel, the rest in _extra"""
+    fields = cls._fieldset
+    set_slot = object.__setattr__
+    extra = None
+    for k, v in attrs.iteritems():
+        if k in fields:
+            set_slot(obj, k, v)
+        else:
+            if extra is None:
+                extra = {}
+                set_slot(obj, '_extra', extra)
+            extra[k] = v
+
+
+class CompactModel(Model):
+    """
+    Model with __slots__ for the known fields of a payload. Keys that are
+    not declared in `fields` go to the `_extra` dict, so the public
+    attributes are the same as with the regular models. Subclasses take
+    the field_spec of their regular model and get a compiled parse that
+    writes the payload straight into the slots; it still takes about a
+    fifth longer than a regular model, which copies the payload into its
+    __dict__ in one call (see tests/bench_models.py).
+    """
+
+    __slots__ = ('_api', '_extra', '__weakref__')
+
+    fields = ()
+    family = 'Compact'
+
+    def __init__(self, api=None):
+        object.__setattr__(self, '_api', api)
+        object.__setattr__(self, '_extra', None)
+
+    def __getattr__(self, name):
+        # only called when the slot lookup failed
+        try:
+            extra = object.__getattribute__(self, '_extra')
+        except AttributeError:
+            raise AttributeError(name)
+        if extra and name in extra:
+            return extra[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+
+    def __getstate__(self):
+        # pickle
+        state = {}
+        for name in self.fields:
+            try:
+                state[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        if self._extra:
+            state.update(self._extra)
+        return state
+
+    def __setstate__(self, state):
+        object.__setattr__(self, '_api', None)
+        object.__setattr__(self, '_extra', None)
+        for k, v in state.items():
+            setattr(self, k, v)
+
+    @classmethod
+    def parse(cls, api, json):
+        # without a field_spec: copy the payload as it is
+        obj = cls(api)
+        _fill_slots(cls, obj, json)
+        if cls.kind is None:
+            return obj
+        return _intern(api, cls.kind, obj)
+
+
+# the type of the descriptors __slots__ creates
+_member_descriptor = type(CompactModel.__dict__['_api'])
+
+
+def _compact(cls):
+    """index the `fields` of a CompactModel subclass for fast lookups"""
+    cls._fieldset = frozenset(cls.fields)
+    return cls
+
+
+STATUS_FIELDS = (
+    'id', 'mid', 'idstr', 'created_at', 'text', 'source', 'source_url',
+    'favorited', 'truncated', 'in_reply_to_status_id',
+    'in_reply_to_user_id', 'in_reply_to_screen_name', 'thumbnail_pic',
+    'bmiddle_pic', 'original_pic', 'geo', 'user', 'author',
+    'retweeted_status', 'reposts_count', 'comments_count',
+    'attitudes_count', 'mlevel', 'visible', 'pic_urls', 'screen_name',
+)
+
+USER_FIELDS = (
+    'id', 'idstr', 'screen_name', 'name', 'province', 'city', 'location',
+    'description', 'url', 'profile_image_url', 'profile_url', 'domain',
+    'weihao', 'gender', 'followers_count', 'friends_count',
+    'statuses_count', 'favourites_count', 'created_at', 'following',
+    'allow_all_act_msg', 'geo_enabled', 'verified', 'verified_type',
+    'verified_reason', 'remark', 'status', 'allow_all_comment',
+    'avatar_large', 'avatar_hd', 'follow_me', 'online_status',
+    'bi_followers_count', 'lang', 'star', 'mbtype', 'mbrank',
+    'block_word',
+)
+
+COMMENTS_FIELDS = (
+    'id', 'mid', 'idstr', 'created_at', 'text', 'source', 'source_url',
+    'user', 'author', 'status', 'reply_comment',
+)
+
+
+@_compact
+class CompactStatus(StatusMethods, CompactModel):
+
+    __slots__ = STATUS_FIELDS
+    fields = STATUS_FIELDS
+    kind = 'status'
+    field_spec = Status.field_spec
+
+
+@_compact
+class CompactComments(StatusMethods, CompactModel):
+
+    __slots__ = COMMENTS_FIELDS
+    fields = COMMENTS_FIELDS
+    field_spec = Comments.field_spec
+
+
+@_compact
+class CompactUser(UserMethods, CompactModel):
+
+    __slots__ = USER_FIELDS
+    fields = USER_FIELDS
+    kind = 'user'
+    field_spec = User.field_spec
+
+    parse_list = User.__dict__['parse_list']
+
+
+def _lazy_field(cls, field):
+    """
+    function(obj, json) -> {attribute: value} for the attributes a Field
+    produces, built on first access by LazyModel
+    """
+    model = None
+    if field.model is not None:
+        model = _spec_model(cls, field.model)
+    names = (field.name, ) + tuple(field.aliases)
+
+    def convert(obj, json):
+        v = json[field.name]
+        if model is not None:
+            v = model.parse(obj._api, v)
+        if field.convert is not None:
+            v = field.convert(v)
+        if field.handler is not None:
+            attrs = {field.name: json[field.name]}
+            field.handler(attrs, v)
+            return attrs
+        return dict.fromkeys(names, v)
+
+    return names, convert
+
+
+class LazyModel(Model):
+    """
+    Model that keeps the raw json dict and builds nested models and
+    datetimes only when they are first accessed. Converted values are
+    cached on the instance, plain values are read from the dict.
+    Subclasses take the field_spec of their regular model; compile_parse
+    turns it into `converters`.
+    """
+
+    family = 'Lazy'
+    # attribute -> function(obj, json) returning {attribute: value}
+    converters = {}
+
+    def __init__(self, api=None, json=None):
+        self._api = api
+        self._json = json if json is not None else {}
+
+    @classmethod
+    def parse(cls, api, json):
+        return cls(api, json)
+
+    def __getattr__(self, name):
+        # only called when the attribute is not in __dict__ yet
+        if name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            json = self.__dict__['_json']
+        except KeyError:
+            raise AttributeError(name)
+        convert = self.converters.get(name)
+        try:
+            if convert is None:
+                return json[name]
+            values = convert(self, json)
+        except KeyError:
+            raise AttributeError(name)
+        # a field may produce several attributes (user and author)
+        self.__dict__.update(values)
+        if name in values:
+            return values[name]
+        # an alias the handler did not set
+        try:
+            return json[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _compile_lazy(cls):
+    """build the converters of a LazyModel subclass from its field_spec"""
+    cls._parse_source = None
+    converters = {}
+    for field in cls.field_spec:
+        names, convert = _lazy_field(cls, field)
+        for name in names:
+            converters[name] = convert
+    cls.converters = converters
+    cls._parse_source = ''
+    return cls
+
+
+class LazyStatus(StatusMethods, LazyModel):
+
+    field_spec = Status.field_spec
+
+
+class LazyComments(StatusMethods, LazyModel):
+
+    field_spec = Comments.field_spec
+
+
+class LazyUser(UserMethods, LazyModel):
+
+    field_spec = User.field_spec
+
+    parse_list = User.__dict__['parse_list']
+
+
+class ModelFactoryType(type):
+    """compiles the parse functions of the models a factory registers"""
+
+    def __init__(cls, name, bases, attrs):
+        type.__init__(cls, name, bases, attrs)
+        for value in attrs.values():
+            if _needs_compile(value):
+                compile_parse(value)
+
+
 class ModelFactory(object):
     """
     Used by parsers for creating instances
     of models. You may subclass this factory
-    to add your own extended models.
+    to add your own extended models; models
+    with a field_spec get a compiled parse.
     """
 
+    __metaclass__ = ModelFactoryType
+
     status = Status
     comments = Comments
     user = User
@@ -380,3 +783,27 @@ class ModelFactory(object):
     counts = Counts
     tags = Tags
     emotion = Emotion
+
+
+class CompactModelFactory(ModelFactory):
+    """
+    Factory for the __slots__ based models. Use it as
+    ModelParser(CompactModelFactory) to keep large numbers of statuses,
+    comments and users in memory.
+    """
+
+    status = CompactStatus
+    comments = CompactComments
+    user = CompactUser
+
+
+class LazyModelFactory(ModelFactory):
+    """
+    Factory for the lazy models: parsing a page only wraps the decoded
+    json, nested objects and datetimes are built on first access.
+    """
+
+    status = LazyStatus
+    comments = LazyComments
+    user = LazyUser
+
@@ -4,8 +4,108 @@
     parser class
 '''
 from models import ModelFactory
+from frame import FRAMES
 from error import WeibopError
-from utils import import_simplejson
+from utils import get_json_backend
+from utils import import_json_backend
+from utils import project_fields
+import re
+
+# wrapper keys of weibo list payloads, e.g. {"statuses": [...], ...}
+LIST_KEYS = (
+    'statuses', 'users', 'comments', 'reposts',
+    'direct_messages', 'favorites', 'ids', 'results',
+)
+
+_special = re.compile(r'[\[\]{},"]')
+_string_special = re.compile(r'["\\]')
+
+
+def iter_json_array(reader, loads, chunk_size=16 * 1024, list_keys=LIST_KEYS):
+    '''
+        incrementally scan a JSON document read from `reader` and yield the
+        elements of its list one by one, decoded with `loads`.
+
+        the list is either the document itself or the value of one of
+        `list_keys` in the top level object. only one element is held in
+        memory at a time.
+    '''
+    depth = 0
+    in_string = False
+    escape = False
+    key_pieces = None
+    last_key = None
+    target = None
+    pieces = []
+
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            return
+        pos = 0
+        end = len(chunk)
+        mark = 0
+        while pos < end:
+            if in_string:
+                if escape:
+                    escape = False
+                    pos += 1
+                    continue
+                m = _string_special.search(chunk, pos)
+                if m is None:
+                    if key_pieces is not None:
+                        key_pieces.append(chunk[pos:])
+                    pos = end
+                    break
+                i = m.start()
+                if key_pieces is not None:
+                    key_pieces.append(chunk[pos:i])
+                pos = i + 1
+                if chunk[i] == '\\':
+                    escape = True
+                    continue
+                in_string = False
+                if key_pieces is not None:
+                    last_key = ''.join(key_pieces)
+                    key_pieces = None
+                continue
+
+            m = _special.search(chunk, pos)
+            if m is None:
+                pos = end
+                break
+            i = m.start()
+            c = chunk[i]
+            pos = i + 1
+            if c == '"':
+                in_string = True
+                if target is None and depth == 1:
+                    key_pieces = []
+            elif c == '[' or c == '{':
+                depth += 1
+                if target is None and c == '[' and \
+                        (depth == 1 or (depth == 2 and last_key in list_keys)):
+                    target = depth
+                    mark = pos
+            elif c == ']' or c == '}':
+                if target is not None and depth == target:
+                    pieces.append(chunk[mark:i])
+                    text = ''.join(pieces).strip()
+                    if text:
+                        yield loads(text)
+                    return
+                depth -= 1
+            elif target is not None and depth == target:
+                # a comma between two elements of the list
+                pieces.append(chunk[mark:i])
+                text = ''.join(pieces).strip()
+                pieces = []
+                mark = pos
+                if text:
+                    yield loads(text)
+
+        if target is not None:
+            pieces.append(chunk[mark:])
 
 class Parser(object):
     '''
@@ -23,6 +123,13 @@ class Parser(object):
         '''
         raise NotImplemented
 
+    def parse_stream(self, method, reader):
+        '''
+            parse a list response incrementally from a file-like `reader`
+            and yield its items
+        '''
+        raise NotImplementedError
+
 
 class JsonObjectParser(Parser):
     '''
@@ -31,10 +138,15 @@ class JsonObjectParser(Parser):
 
     payload_format = 'json'
 
-    def __init__(self):
+    def __init__(self, json_backend=None):
         '''
+            `json_backend` is a name from utils.JSON_BACKENDS or a
+            JsonBackend; by default the fastest one installed is used.
         '''
-        self.json = import_simplejson()
+        if json_backend is None:
+            self.json = get_json_backend()
+        else:
+            self.json = import_json_backend(json_backend)
 
     def parse(self, method, payload):
         '''
@@ -60,14 +172,22 @@ class JsonObjectParser(Parser):
 
         return json
 
+    def parse_stream(self, method, reader):
+        '''
+            yield the decoded items of a list payload
+        '''
+        return iter_json_array(reader, self.json.loads)
+
 
 class ModelParser(JsonObjectParser):
 
-    def __init__(self, model_factory=None):
-        JsonObjectParser.__init__(self)
+    def __init__(self, model_factory=None, json_backend=None):
+        JsonObjectParser.__init__(self, json_backend)
         self.model_factory = model_factory or ModelFactory
                                                
     def parse(self, method, payload):
+        if method.payload_format == 'frame':
+            return self.parse_frame(method, payload)
         try:
             if method.payload_type is None:
                 return
@@ -82,6 +202,9 @@ class ModelParser(JsonObjectParser):
         else:
             cursors = None
 
+        if method.fields is not None:
+            json = self.project(json, method.fields)
+
         if method.payload_list:
             result = model.parse_list(method.api, json)
         else:
@@ -90,3 +213,54 @@ class ModelParser(JsonObjectParser):
             return result, cursors
         else:
             return result
+
+    def project(self, json, fields):
+        '''
+            keep only the requested fields of the payload's items. the
+            other keys of a wrapper object (cursors, totals) are kept.
+        '''
+        if isinstance(json, dict):
+            for key in LIST_KEYS:
+                if isinstance(json.get(key), list):
+                    json = dict(json)
+                    json[key] = project_fields(json[key], fields)
+                    return json
+        return project_fields(json, fields)
+
+    def parse_frame(self, method, payload):
+        '''
+            build a columnar frame straight from the decoded json
+        '''
+        try:
+            frame = FRAMES[method.payload_type]
+        except KeyError:
+            raise WeibopError(
+                'No frame for this payload type: %s' % (method.payload_type, ))
+
+        json = JsonObjectParser.parse(self, method, payload)
+        if isinstance(json, dict):
+            for key in LIST_KEYS:
+                if key in json:
+                    json = json[key]
+                    break
+            else:
+                json = [json]
+        return frame.from_json(json)
+
+    def parse_stream(self, method, reader):
+        try:
+            if method.payload_type is None or method.payload_type == 'json':
+                model = None
+            else:
+                model = getattr(self.model_factory, method.payload_type)
+        except AttributeError:
+            raise WeibopError(
+                'No model for this payload type: %s' % (method.payload_type, ))
+
+        for json in JsonObjectParser.parse_stream(self, method, reader):
+            if method.fields is not None:
+                json = project_fields(json, method.fields)
+            if model is None:
+                yield json
+            else:
+                yield model.parse(method.api, json)
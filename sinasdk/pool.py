@@ -0,0 +1,135 @@
+# coding=utf8
+
+'''
+    keep-alive connection pool
+'''
+import httplib
+import socket
+import threading
+import time
+
+
+class ConnectionPool(object):
+    '''
+        a thread-safe pool of keep-alive connections, keyed by host.
+
+        idle connections are reused across requests and retries. at most
+        `maxsize` idle connections are kept per host, and connections that
+        have been idle longer than `idle_timeout` seconds are dropped.
+    '''
+
+    connection_class = httplib.HTTPSConnection
+
+    def __init__(self, maxsize=10, idle_timeout=60, connection_class=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        if connection_class is not None:
+            self.connection_class = connection_class
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _new_conn(self, host):
+        return self.connection_class(host)
+
+    def _get_conn(self, host):
+        '''
+            return (conn, reused). reuses the most recently released idle
+            connection for `host`, evicting stale ones on the way.
+        '''
+        now = time.time()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(host)
+            while idle:
+                candidate, released_at = idle.pop()
+                if now - released_at < self.idle_timeout:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+
+        for s in stale:
+            s.close()
+
+        if conn is not None:
+            return conn, True
+        return self._new_conn(host), False
+
+    def _send(self, conn, method, url, body, headers,
+              connect_timeout, read_timeout):
+        if conn.sock is None:
+            if connect_timeout is not None:
+                conn.timeout = connect_timeout
+            conn.connect()
+        conn.sock.settimeout(read_timeout)
+        conn.request(method, url, body=body, headers=headers or {})
+        return conn.getresponse()
+
+    def urlopen(self, host, method, url, body=None, headers=None,
+                connect_timeout=None, read_timeout=None):
+        '''
+            send a request and return (conn, resp). if a kept-alive
+            connection turns out to be closed by the server, reconnect
+            once on a fresh connection.
+
+            `connect_timeout` bounds the TCP/TLS handshake of a new
+            connection and `read_timeout` every blocking socket operation
+            after that. None means no timeout.
+        '''
+        conn, reused = self._get_conn(host)
+        try:
+            resp = self._send(conn, method, url, body, headers,
+                              connect_timeout, read_timeout)
+        except socket.timeout:
+            conn.close()
+            raise
+        except (httplib.BadStatusLine, httplib.CannotSendRequest, socket.error):
+            conn.close()
+            if not reused:
+                raise
+        except Exception:
+            conn.close()
+            raise
+        else:
+            return conn, resp
+
+        conn = self._new_conn(host)
+        try:
+            resp = self._send(conn, method, url, body, headers,
+                              connect_timeout, read_timeout)
+        except Exception:
+            conn.close()
+            raise
+        return conn, resp
+
+    def release(self, host, conn, resp=None):
+        '''
+            give a connection back to the pool. the response body must have
+            been read completely before calling this.
+        '''
+        if resp is not None and resp.will_close:
+            conn.close()
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(host, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def discard(self, conn):
+        '''
+            drop a connection that is in an unknown state.
+        '''
+        conn.close()
+
+    def clear(self):
+        '''
+            close all idle connections.
+        '''
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn, released_at in conns:
+                conn.close()
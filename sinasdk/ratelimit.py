@@ -0,0 +1,280 @@
+# coding=utf8
+
+'''
+    token-bucket rate limiting shared between clients and processes
+'''
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+from error import WeibopError
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    elapsed = now - updated
+    if elapsed > 0:
+        tokens = min(capacity, tokens + elapsed * rate)
+    return tokens
+
+
+class Backend(object):
+    '''
+        where token buckets keep their state. buckets are identified by a
+        key, and created full the first time they are used. every method
+        must be atomic with respect to every other user of the backend:
+        threads of this process for MemoryBackend, all processes of the
+        host for MmapBackend, all hosts for a networked store.
+    '''
+
+    def take(self, key, n, capacity, rate):
+        '''
+            refill the bucket and take `n` tokens if they are there.
+            returns 0 on success, otherwise the seconds until they will
+            be, taking nothing.
+        '''
+        raise NotImplementedError
+
+    def tokens(self, key, capacity, rate):
+        '''
+            the refilled balance of the bucket.
+        '''
+        raise NotImplementedError
+
+    def set_tokens(self, key, tokens, capacity, rate):
+        raise NotImplementedError
+
+
+class MemoryBackend(Backend):
+    '''
+        buckets in a dict, shared by the threads of one process.
+    '''
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _refilled(self, key, capacity, rate):
+        now = self._clock()
+        state = self._buckets.get(key)
+        if state is None:
+            return capacity, now
+        return _refill(state[0], state[1], now, capacity, rate), now
+
+    def take(self, key, n, capacity, rate):
+        with self._lock:
+            tokens, now = self._refilled(key, capacity, rate)
+            if tokens >= n:
+                tokens -= n
+                wait = 0
+            else:
+                wait = (n - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            return wait
+
+    def tokens(self, key, capacity, rate):
+        with self._lock:
+            return self._refilled(key, capacity, rate)[0]
+
+    def set_tokens(self, key, tokens, capacity, rate):
+        with self._lock:
+            self._buckets[key] = (tokens, self._clock())
+
+
+class MmapBackend(Backend):
+    '''
+        buckets in a memory-mapped file, shared by every process of the
+        host that opens the same `path` (put it on tmpfs, e.g. /dev/shm).
+
+        the file is a header and `slots` fixed-size records: a 64-bit hash
+        of the bucket key, the tokens and the time of the last update.
+        a record is claimed by open addressing on the hash the first time
+        a key is used, and never moves. updates take an exclusive flock on
+        the file, so they are atomic across processes; the time comes from
+        the wall clock, which all processes share.
+    '''
+
+    MAGIC = 'WBRL'
+    VERSION = 1
+    _header = struct.Struct('<4sII')
+    _record = struct.Struct('<Qdd')
+
+    def __init__(self, path, slots=4096, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._offsets = {}
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                size = self._header.size + slots * self._record.size
+                os.ftruncate(self._fd, size)
+                os.write(self._fd, self._header.pack(
+                    self.MAGIC, self.VERSION, slots))
+            self._map = mmap.mmap(self._fd, size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        magic, version, self.slots = self._header.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            self.close()
+            raise WeibopError('Not a rate limit file: %s' % path)
+
+    def _hash(self, key):
+        h = struct.unpack('<Q', hashlib.md5(repr(key)).digest()[:8])[0]
+        # 0 marks a free record
+        return h or 1
+
+    def _offset(self, key):
+        '''
+            the record of `key`, claiming a free one for a new key. must be
+            called with the file locked.
+        '''
+        offset = self._offsets.get(key)
+        if offset is not None:
+            return offset
+        h = self._hash(key)
+        start = h % self.slots
+        for i in xrange(self.slots):
+            offset = self._header.size + \
+                ((start + i) % self.slots) * self._record.size
+            found = self._record.unpack_from(self._map, offset)[0]
+            if found == h:
+                break
+            if found == 0:
+                self._record.pack_into(self._map, offset, h, -1.0, 0.0)
+                break
+        else:
+            raise WeibopError('Rate limit file is full: %s' % self.path)
+        self._offsets[key] = offset
+        return offset
+
+    def _update(self, key, capacity, rate, fn):
+        '''
+            run fn(tokens, now) -> (tokens, result) on the refilled bucket
+            under the file lock, store the new tokens and return result.
+        '''
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                offset = self._offset(key)
+                h, tokens, updated = self._record.unpack_from(self._map, offset)
+                now = self._clock()
+                if tokens < 0:
+                    # freshly claimed
+                    tokens = capacity
+                else:
+                    tokens = _refill(tokens, updated, now, capacity, rate)
+                tokens, result = fn(tokens, now)
+                self._record.pack_into(self._map, offset, h, tokens, now)
+                return result
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def take(self, key, n, capacity, rate):
+        def _take(tokens, now):
+            if tokens >= n:
+                return tokens - n, 0
+            return tokens, (n - tokens) / rate
+        return self._update(key, capacity, rate, _take)
+
+    def tokens(self, key, capacity, rate):
+        return self._update(key, capacity, rate, lambda t, now: (t, t))
+
+    def set_tokens(self, key, tokens, capacity, rate):
+        self._update(key, capacity, rate, lambda t, now: (tokens, None))
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class TokenBucket(object):
+    '''
+        holds up to `capacity` tokens and refills continuously, `capacity`
+        tokens per `period` seconds, instead of all at once when the
+        period ends. each request takes one token.
+
+        the state lives in `backend` under `key`: by default a private
+        MemoryBackend, so the bucket is shared by the threads that use it.
+        buckets with the same key on an MmapBackend share their tokens
+        across processes.
+    '''
+
+    def __init__(self, capacity, period, clock=time.time, backend=None,
+                 key=None):
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.rate = self.capacity / self.period
+        self._clock = clock
+        self.backend = backend if backend is not None else MemoryBackend(clock)
+        self.key = key
+
+    def take(self, n=1):
+        '''
+            take `n` tokens if they are there. returns 0 on success,
+            otherwise the seconds until they will be, taking nothing.
+        '''
+        return self.backend.take(self.key, n, self.capacity, self.rate)
+
+    def acquire(self, n=1, block=False, timeout=None):
+        '''
+            take `n` tokens. fail-fast by default: returns False at once
+            when the bucket is short. with `block`, wait for the refill
+            instead, for at most `timeout` seconds (None: as long as it
+            takes); returns False if that is not enough.
+        '''
+        if n > self.capacity:
+            return False
+        deadline = None if timeout is None else self._clock() + timeout
+        while True:
+            wait = self.take(n)
+            if not wait:
+                return True
+            if not block:
+                return False
+            if deadline is not None:
+                left = deadline - self._clock()
+                if left <= 0 or wait > left:
+                    return False
+            # other threads may get there first; just try again
+            time.sleep(wait)
+
+    @property
+    def remaining(self):
+        '''
+            whole tokens available right now.
+        '''
+        return int(self.backend.tokens(self.key, self.capacity, self.rate))
+
+    def set_remaining(self, tokens):
+        '''
+            overwrite the balance, e.g. with the remaining hits the server
+            reports.
+        '''
+        tokens = max(0.0, min(self.capacity, float(tokens)))
+        self.backend.set_tokens(self.key, tokens, self.capacity, self.rate)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def shared_bucket(key, capacity, period, backend=None):
+    '''
+        the process-wide bucket for `key` (an app key or access token),
+        created on first use. every client asking for the same key draws
+        from the same tokens; with an MmapBackend, so does every process
+        using the same file.
+    '''
+    with _buckets_lock:
+        bucket = _buckets.get((key, backend))
+        if bucket is None:
+            bucket = _buckets[(key, backend)] = TokenBucket(
+                capacity, period, backend=backend, key=key)
+        return bucket
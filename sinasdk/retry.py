@@ -0,0 +1,81 @@
+# coding=utf8
+
+'''
+    retry helpers: backoff, Retry-After and retry budgets
+'''
+import random
+import threading
+import time
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+
+def backoff_delay(attempt, base, cap):
+    '''
+        exponential backoff with full jitter: a random delay between 0 and
+        min(cap, base * 2 ** attempt) seconds.
+    '''
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def retry_after(resp):
+    '''
+        seconds to wait according to the Retry-After header of `resp`, or
+        None. both delta-seconds and HTTP-date forms are understood.
+    '''
+    value = resp.getheader('retry-after')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0, mktime_tz(parsed) - time.time())
+
+
+class RetryBudget(object):
+    '''
+        limits retries to a fraction of the requests sent.
+
+        every request deposits `ratio` of a token and every retry needs a
+        whole one, so retries stay below `ratio` of the traffic. the
+        balance starts at `min_retries` so that a fresh process can still
+        retry, and is capped at `max_balance`.
+    '''
+
+    def __init__(self, ratio=0.1, min_retries=10, max_balance=100):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.max_balance = max_balance
+        self.balance = float(min_retries)
+        self.requests = 0
+        self.retries = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        '''
+            record a request.
+        '''
+        with self._lock:
+            self.requests += 1
+            self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def withdraw(self):
+        '''
+            ask for permission to retry. returns False when the budget is
+            spent.
+        '''
+        with self._lock:
+            if self.balance < 1:
+                self.rejected += 1
+                return False
+            self.balance -= 1
+            self.retries += 1
+            return True
+
+
+# shared by every API instance that does not bring its own budget
+default_budget = RetryBudget()
@@ -0,0 +1,374 @@
+# coding=utf8
+
+'''
+    compact binary encoding for models, for caches and queues.
+
+    layout: 'WBM' + version byte, the string table, then one value.
+    every distinct string of a batch is stored once in the table and
+    referenced by index afterwards, and a model that appears twice (e.g.
+    status.user and status.author) is encoded once and referenced
+    afterwards. the field names of a model are written once per batch as
+    a shape, and each model of that shape only lists its values.
+
+    subclasses are encoded as their nearest base in MODELS. lazy models
+    keep only their raw json, and come back lazy.
+'''
+import struct
+from itertools import izip
+from datetime import datetime
+from datetime import timedelta
+
+from error import WeibopError
+from models import ResultSet
+from models import Status
+from models import User
+from models import Comments
+from models import DirectMessage
+from models import Geo
+from models import CompactStatus
+from models import CompactUser
+from models import CompactComments
+from models import LazyModel
+from models import LazyStatus
+from models import LazyUser
+from models import LazyComments
+
+MAGIC = 'WBM'
+VERSION = 2
+
+# the position in this tuple is written to the stream: only ever append
+MODELS = (
+    Status, User, Comments, DirectMessage, Geo,
+    CompactStatus, CompactUser, CompactComments,
+    LazyStatus, LazyUser, LazyComments,
+)
+_MODEL_INDEX = dict((cls, i) for i, cls in enumerate(MODELS))
+
+_EPOCH = datetime(1970, 1, 1)
+_double = struct.Struct('>d')
+
+# value tags
+_NONE, _TRUE, _FALSE, _INT, _NEGINT, _FLOAT, _STR, _LIST, _DICT, \
+    _DATETIME, _MODEL, _REF, _LAZY = range(13)
+_CONSTANTS = (None, True, False)
+# string table tags
+_BYTES, _UNICODE = range(2)
+
+
+def _varint(out, n):
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _model_index(cls):
+    '''
+        the position in MODELS of cls or its nearest registered base, None
+        if it has none.
+    '''
+    try:
+        return _MODEL_INDEX[cls]
+    except KeyError:
+        pass
+    for base in cls.__mro__[1:]:
+        i = _MODEL_INDEX.get(base)
+        if i is not None:
+            break
+    else:
+        i = None
+    # remembered for the next instance, also when there is no base
+    _MODEL_INDEX[cls] = i
+    return i
+
+
+class _Encoder(object):
+
+    def __init__(self):
+        self.out = bytearray()
+        self.bytes_index = {}
+        self.unicode_index = {}
+        self.table = []
+        self.objects = {}
+        # (class index, keys) -> (shape index, the keys that are encoded)
+        self.shapes = {}
+
+    def string(self, value, index, tag):
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(self.table)
+            self.table.append((tag, value))
+        return i
+
+    def encode(self, value):
+        out = self.out
+        t = type(value)
+        if t is str:
+            out.append(_STR)
+            _varint(out, self.string(value, self.bytes_index, _BYTES))
+        elif t is unicode:
+            out.append(_STR)
+            _varint(out, self.string(value, self.unicode_index, _UNICODE))
+        elif t is bool:
+            out.append(_TRUE if value else _FALSE)
+        elif t is int or t is long:
+            if value < 0:
+                out.append(_NEGINT)
+                _varint(out, -value)
+            else:
+                out.append(_INT)
+                _varint(out, value)
+        elif value is None:
+            out.append(_NONE)
+        elif t is float:
+            out.append(_FLOAT)
+            out.extend(_double.pack(value))
+        elif t is dict:
+            self.mapping(value)
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            _varint(out, len(value))
+            for item in value:
+                self.encode(item)
+        elif t is datetime:
+            delta = value - _EPOCH
+            seconds = delta.days * 86400 + delta.seconds
+            out.append(_DATETIME)
+            # zigzag, dates before 1970 are rare but possible
+            _varint(out, seconds * 2 if seconds >= 0 else -seconds * 2 - 1)
+            _varint(out, value.microsecond)
+        else:
+            i = _model_index(t)
+            if i is None:
+                raise WeibopError('Cannot serialize %s' % t.__name__)
+            self.model(value, i)
+
+    def mapping(self, value):
+        out = self.out
+        out.append(_DICT)
+        _varint(out, len(value))
+        for k, v in value.iteritems():
+            self.encode(k)
+            self.encode(v)
+
+    def model(self, obj, i):
+        out = self.out
+        ref = self.objects.get(id(obj))
+        if ref is not None:
+            out.append(_REF)
+            _varint(out, ref)
+            return
+        self.objects[id(obj)] = len(self.objects)
+        if isinstance(obj, LazyModel):
+            out.append(_LAZY)
+            _varint(out, i)
+            self.encode(obj._json)
+            return
+        out.append(_MODEL)
+        _varint(out, i)
+        state = getattr(obj, '__dict__', None)
+        if state is None:
+            state = obj.__getstate__()
+        key = (i, tuple(state))
+        shape = self.shapes.get(key)
+        if shape is None:
+            # a new shape is defined where it is first used
+            fields = [k for k in key[1] if k != '_api']
+            shape = self.shapes[key] = (len(self.shapes), fields)
+            _varint(out, shape[0])
+            _varint(out, len(fields))
+            for k in fields:
+                self.encode(k)
+        else:
+            _varint(out, shape[0])
+        encode = self.encode
+        string = self.string
+        unicode_index = self.unicode_index
+        for k in shape[1]:
+            v = state[k]
+            # the common types without the generic dispatch
+            t = type(v)
+            if t is unicode:
+                out.append(_STR)
+                _varint(out, string(v, unicode_index, _UNICODE))
+            elif t is int and v >= 0:
+                out.append(_INT)
+                _varint(out, v)
+            elif v is None:
+                out.append(_NONE)
+            else:
+                encode(v)
+
+    def getvalue(self):
+        head = bytearray(MAGIC)
+        head.append(VERSION)
+        _varint(head, len(self.table))
+        for tag, value in self.table:
+            if tag == _UNICODE:
+                value = value.encode('utf8')
+            head.append(tag)
+            _varint(head, len(value))
+            head.extend(value)
+        return str(head + self.out)
+
+
+class _Decoder(object):
+
+    def __init__(self, data, api):
+        if data[:3] != MAGIC:
+            raise WeibopError('Not a serialized model stream')
+        version = ord(data[3])
+        if version != VERSION:
+            raise WeibopError('Unsupported serialization version: %d' % version)
+        self.data = data
+        # indexing a bytearray gives ints, no ord() per byte
+        self.buf = bytearray(data)
+        self.api = api
+        self.pos = 4
+        self.objects = []
+        self.shapes = []
+        self.table = table = []
+        for i in xrange(self.varint()):
+            tag = self.buf[self.pos]
+            self.pos += 1
+            size = self.varint()
+            value = data[self.pos:self.pos + size]
+            self.pos += size
+            table.append(value.decode('utf8') if tag == _UNICODE else value)
+
+    def varint(self):
+        buf = self.buf
+        pos = self.pos
+        b = buf[pos]
+        pos += 1
+        if b < 0x80:
+            self.pos = pos
+            return b
+        result = b & 0x7f
+        shift = 7
+        while True:
+            b = buf[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        self.pos = pos
+        return result
+
+    def decode(self):
+        tag = self.buf[self.pos]
+        self.pos += 1
+        if tag == _STR:
+            return self.table[self.varint()]
+        if tag == _INT:
+            return self.varint()
+        if tag == _DICT:
+            return self.mapping()
+        if tag == _MODEL:
+            return self.model()
+        if tag == _LAZY:
+            return self.lazy()
+        if tag == _REF:
+            return self.objects[self.varint()]
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _NEGINT:
+            return -self.varint()
+        if tag == _LIST:
+            return [self.decode() for i in xrange(self.varint())]
+        if tag == _DATETIME:
+            zigzag = self.varint()
+            seconds = zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+            return _EPOCH + timedelta(
+                seconds=seconds, microseconds=self.varint())
+        if tag == _FLOAT:
+            value = _double.unpack_from(self.data, self.pos)[0]
+            self.pos += 8
+            return value
+        raise WeibopError('Corrupt serialized data, unknown tag %d' % tag)
+
+    def mapping(self):
+        result = {}
+        buf = self.buf
+        table = self.table
+        decode = self.decode
+        for i in xrange(self.varint()):
+            # keys are nearly always strings: skip the generic dispatch
+            if buf[self.pos] == _STR:
+                self.pos += 1
+                k = table[self.varint()]
+            else:
+                k = decode()
+            result[k] = decode()
+        return result
+
+    def model(self):
+        cls = MODELS[self.varint()]
+        obj = cls.__new__(cls)
+        # register before the fields: nested values may refer back to it
+        self.objects.append(obj)
+        i = self.varint()
+        if i == len(self.shapes):
+            self.shapes.append(
+                tuple(self.decode() for j in xrange(self.varint())))
+        fields = self.shapes[i]
+        buf = self.buf
+        table = self.table
+        varint = self.varint
+        decode = self.decode
+        values = []
+        append = values.append
+        for k in fields:
+            # the common tags without the generic dispatch
+            tag = buf[self.pos]
+            if tag == _STR:
+                self.pos += 1
+                append(table[varint()])
+            elif tag == _INT:
+                self.pos += 1
+                append(varint())
+            elif tag <= _FALSE:
+                self.pos += 1
+                append(_CONSTANTS[tag])
+            else:
+                append(decode())
+        state = dict(izip(fields, values))
+        if hasattr(obj, '__dict__'):
+            state['_api'] = self.api
+            obj.__dict__.update(state)
+        else:
+            obj.__setstate__(state)
+            object.__setattr__(obj, '_api', self.api)
+        return obj
+
+    def lazy(self):
+        cls = MODELS[self.varint()]
+        obj = cls.__new__(cls)
+        self.objects.append(obj)
+        cls.__init__(obj, self.api, self.decode())
+        return obj
+
+
+def dumps(obj):
+    '''
+        encode a model, or a list of models, to a compact binary string.
+    '''
+    encoder = _Encoder()
+    encoder.encode(obj)
+    return encoder.getvalue()
+
+
+def loads(data, api=None):
+    '''
+        decode the output of dumps. `api` is attached to every model so
+        their methods work again. a list comes back as a ResultSet.
+    '''
+    value = _Decoder(data, api).decode()
+    if isinstance(value, list):
+        value = ResultSet(value)
+    return value
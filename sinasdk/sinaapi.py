@@ -1,10 +1,17 @@
 # coding=utf8
 
 from api import API
+from ratelimit import shared_bucket
+from cursor import Cursor
+from cursor import PrefetchCursor
+from crawl import CrawlJob
+from sync import stream_method
+from idset import IdSetBuilder
 from utils import build_parameters
 from error import WeibopError
-from datetime import datetime, timedelta
+from datetime import timedelta
 from time import time, mktime
+from multiprocessing.pool import ThreadPool
 from django.utils import simplejson
 from auth import _request_access_token
 from auth import _request_refresh_token
@@ -31,6 +38,20 @@ class TooManyRequests(Exception):
         return self.reason
 
 
+class BulkResult(object):
+    '''
+        outcome of one item of SinaAPI.map: either `value` or `error` is set.
+    '''
+    def __init__(self, item, value=None, error=None):
+        self.item = item
+        self.value = value
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
 def check_remain_requests(msg='Too many requests'):
     '''
         decorator to check remain request times.
@@ -40,12 +61,7 @@ def check_remain_requests(msg='Too many requests'):
         def wrapr(*args, **kwargs):
             'calculate remain request tims.'
             api_obj_self = args[0]
-            api_obj_self._testResetTime()
-
-            if api_obj_self.request_limit < 1:
-                raise TooManyRequests(msg)
-
-            api_obj_self.request_limit -= 1
+            api_obj_self._acquire(msg)
             return fn(*args, **kwargs)
         return wrapr
 
@@ -70,6 +86,10 @@ class SinaAPI(object):
         domain='api.weibo.com',
         response_type='code',
         version='2',
+        limit_by='app',
+        limit_block=False,
+        limit_timeout=None,
+        limit_backend=None,
     ):
         self.client_id = app_key
         self.client_secret = app_secret
@@ -80,8 +100,17 @@ class SinaAPI(object):
         self.access_token = None
         self.expires = 0.0
 
+        # requests are limited per app key, or per access token with
+        # limit_by='token'; either way the bucket is shared by every
+        # SinaAPI of the process with the same key, and of every process
+        # on the host with a shared ratelimit.MmapBackend
+        self.limit_by = limit_by
+        self.limit_backend = limit_backend
+        self.limit_block = limit_block
+        self.limit_timeout = limit_timeout
+        self.limiter = self._bucket(app_key)
+        self.limit_synced_at = time()
         self._resetLimit()
-        self.limit_reset_time = datetime.now()+self.LIMIT_RESET_INTERVAL
 
 
     def set_access_token(self, access_token, expires):
@@ -91,20 +120,139 @@ class SinaAPI(object):
         self.access_token = access_token
         self.expires = float(expires)
         self.api = API(access_token, self.client_secret)
+        if self.limit_by == 'token':
+            self.limiter = self._bucket(access_token)
+
+    def _bucket(self, key):
+        return shared_bucket(
+            (self.limit_by, key),
+            self.REQUEST_LIMIT,
+            self.LIMIT_RESET_INTERVAL.total_seconds(),
+            self.limit_backend,
+        )
 
     def _resetLimit(self):
-        self.request_limit = self.REQUEST_LIMIT
         self.status_limit = self.STATUS_LIMIT
         self.message_limit = self.MESSAGE_LIMIT    
 
+    @property
+    def request_limit(self):
+        '''
+            requests left in the rate-limit bucket right now.
+        '''
+        return self.limiter.remaining
+
+    def syncRateLimit(self):
+        '''
+            set the bucket to the remaining hits the server reports. done
+            by _acquire once per LIMIT_RESET_INTERVAL, so the bucket follows
+            the server's quota when other clients use the same key.
+        '''
+        self.limit_synced_at = time()
+        self.limiter.set_remaining(self.getRateLimit().remaining_hits)
 
     def _testResetTime(self):
-        t = datetime.now()
-        if t > self.limit_reset_time:
-            self.request_limit = self.getRateLimit().remaining_hits
-            self.limit_reset_time = t + self.LIMIT_RESET_INTERVAL
+        if getattr(self, 'api', None) is None:
+            # no access token yet
+            return
+        if time() - self.limit_synced_at < \
+                self.LIMIT_RESET_INTERVAL.total_seconds():
+            return
+        try:
+            self.syncRateLimit()
+        except (WeibopError, AttributeError):
+            # failed, or no remaining_hits in the answer: keep counting
+            # locally and try again next interval
+            logger.info("syncRateLimit failed")
+
+    def _acquire(self, msg='Too many requests'):
+        self._testResetTime()
+        if not self.limiter.acquire(
+                block=self.limit_block, timeout=self.limit_timeout):
+            raise TooManyRequests(msg)
     
 
+    def _limited(self, method, msg='Too many requests'):
+        '''
+            wrap an api call so that every request it makes, e.g. every
+            page of a Cursor, is counted against the request limit.
+        '''
+        def call(*args, **kwargs):
+            self._acquire(msg)
+            return method(*args, **kwargs)
+
+        call.pagination_mode = getattr(method, 'pagination_mode', None)
+        return call
+
+    def cursor(self, method_name, **kwargs):
+        '''
+            a Cursor over the api call `method_name` that respects the
+            request limit. iterate `.items()` or `.pages()` to stream the
+            results instead of collecting them in a list.
+        '''
+        method = getattr(self.api, method_name)
+        return Cursor(self._limited(
+            method, 'Too many requests in %s' % method_name), **kwargs)
+
+    def prefetch(self, method_name, depth=4, **kwargs):
+        '''
+            like cursor, but page-mode endpoints (user_timeline, comments,
+            repost_timeline, search_user, ...) fetch up to `depth` pages
+            concurrently. the depth shrinks as the rate limit runs low.
+        '''
+        method = getattr(self.api, method_name)
+        return PrefetchCursor(
+            self._limited(method, 'Too many requests in %s' % method_name),
+            depth=depth,
+            capacity=lambda: self.limiter.remaining,
+            **kwargs
+        )
+
+    def crawl(self, method_name, path, every=10, **kwargs):
+        '''
+            a CrawlJob over the api call `method_name`, checkpointed to
+            `path`, whose requests count against the request limit. running
+            out of requests raises TooManyRequests after the checkpoint is
+            saved; run the job again later to continue.
+        '''
+        job = CrawlJob(self.api, method_name, path, every, **kwargs)
+        job.method = self._limited(
+            job.method, 'Too many requests in %s' % method_name)
+        return job
+
+    def sync(self, engine, account, stream, **kwargs):
+        '''
+            the items of `stream` (mentions, comments_to_me, comments_by_me,
+            direct_messages, user_timeline) that are new since the last
+            sync of `account` with `engine`, a sync.SyncEngine.
+        '''
+        method = self._limited(
+            stream_method(self.api, stream), 'Too many requests in sync')
+        return engine.fetch(method, account, stream, **kwargs)
+
+    def map(self, method_name, items, workers=8, **kwargs):
+        '''
+            call `method_name` once per item on a pool of `workers` threads.
+
+            yields a BulkResult per item, in input order, as soon as it and
+            every item before it are done. a failing item does not abort the
+            batch; its exception is kept on the result.
+        '''
+        fn = getattr(self, method_name)
+
+        def _run(item):
+            try:
+                return BulkResult(item, value=fn(item, **kwargs))
+            except Exception as e:
+                return BulkResult(item, error=e)
+
+        pool = ThreadPool(workers)
+        try:
+            for result in pool.imap(_run, items):
+                yield result
+        finally:
+            pool.terminate()
+
     def getAtt(self, key):
         try:
             return self.obj.__getattribute__(key)
@@ -191,80 +339,56 @@ class SinaAPI(object):
             return self.api.tags(uid=uid, count=count)
 
 
-    def getDirectMsgs(self, since_id=None, count=200):
+    def getDirectMsgs(self, since_id=None, count=200, fields=None):
         logger.info('api-nail')
-        page = 1
-        rvl=[]
-        while True:
-            self._testResetTime()
-
-            if self.request_limit < 1:
-                raise TooManyRequests('Too many requests in getDirectMsgs')
-            self.request_limit -= 1
-            if since_id:
-                directMsgs = self.api.direct_messages(since_id=since_id, count=count, page=page)
-            else:
-                directMsgs = self.api.direct_messages(count=count, page=page)
-            rvl.extend(directMsgs)
-            if len(directMsgs) < count:
-                break;
-            page +=1
-        return rvl
+        params = {'count': count, 'fields': fields}
+        if since_id:
+            params['since_id'] = since_id
+        cursor = Cursor(self._limited(
+            self.api.direct_messages, 'Too many requests in getDirectMsgs'),
+            **params)
+        return list(cursor.items())
 
 
-    def getSentDirectMsgs(self, since_id=None, count=200):
+    def getSentDirectMsgs(self, since_id=None, count=200, fields=None):
         logger.info('api-nail')
-        page = 1
-        rvl=[]
-        while True:
-            self._testResetTime()
-
-            if self.request_limit < 1:
-                raise TooManyRequests('Too many requests in getDirectMsgs')
-            self.request_limit -= 1
-            if since_id:
-                directMsgs = self.api.sent_direct_messages(since_id=since_id, count=count, page=page)
-            else:
-                directMsgs = self.api.sent_direct_messages(count=count, page=page)
-            rvl.extend(directMsgs)
-            if len(directMsgs) < count:
-                break;
-            page +=1
-        return rvl
+        params = {'count': count, 'fields': fields}
+        if since_id:
+            params['since_id'] = since_id
+        cursor = Cursor(self._limited(
+            self.api.sent_direct_messages, 'Too many requests in getDirectMsgs'),
+            **params)
+        return list(cursor.items())
 
 
-    def getFollowers(self, uid, cursor=-1, count=200):
+    def getFollowers(self, uid, cursor=-1, count=200, fields=None):
         status = []
         logger.info('api-nail')
 
-        self._testResetTime()
-
-        if self.request_limit < 1:
-            raise TooManyRequests('Too many requests in getFollowers')
-        self.request_limit -= 1
+        self._acquire('Too many requests in getFollowers')
 
         try:
             for i in range(3):
-                status = self.api.followers(uid=uid, cursor=cursor,count=count)
+                status = self.api.followers(uid=uid, cursor=cursor,count=count, fields=fields)
                 if status:
                     break
                 else:
-                    status = self.api.followers(uid=uid, cursor=cursor,count=count)
+                    status = self.api.followers(uid=uid, cursor=cursor,count=count, fields=fields)
         except WeibopError:
             logger.info("WeibopError") 
             return status 
 
         return status 
 
-    def getFollowersById(self, user_id, cursor=-1, count=200):
+    def getFollowersById(self, user_id, cursor=-1, count=200, fields=None):
         logger.info('api-nail')
         status = []
 
         i = 0
         try:
-            status = self.api.followers(uid=user_id, cursor=cursor, count=count)
+            status = self.api.followers(uid=user_id, cursor=cursor, count=count, fields=fields)
             while not status and i < 3:
-                status = self.api.followers(uid=user_id, cursor=cursor, count=count)
+                status = self.api.followers(uid=user_id, cursor=cursor, count=count, fields=fields)
                 i += 1
         except WeibopError:
             logger.info("WeibopError") 
@@ -273,26 +397,31 @@ class SinaAPI(object):
         return status 
 
     def getFollowersIds(self, uid):
+        return list(self.getFollowersIdSet(uid))
+
+    def getFollowersIdSet(self, uid):
+        '''
+            the ids of all followers of `uid` as an IdSet, streamed page by
+            page into int64 arrays.
+        '''
         logger.info('api-nail')
-        cursor = 0
-        count = SINAAPI_FOLLOWERS_ID_MAX_COUNT
-        rvl=[]
-        while True:
-            self._testResetTime()
-            if self.request_limit < 1:
-                raise TooManyRequests('Too many requests in getFollowersIds')
-            self.request_limit -= 1
-            try:
-                status = self.api.followers_ids(uid=uid, cursor=cursor,count=count)
-            except WeibopError:
-                logger.info("WeibopError") 
-                return list(set(rvl))
-            if len(status.ids) == 0:
-                break;
-            else:
-                cursor += len(status.ids)
-                rvl.extend(status.ids)
-        return list(set(rvl))
+        return self._collectIdSet(
+            self.api.followers_ids, 'Too many requests in getFollowersIdSet',
+            uid=uid, count=SINAAPI_FOLLOWERS_ID_MAX_COUNT)
+
+    def _collectIdSet(self, method, msg, **params):
+        '''
+            walk every page of the ids endpoint `method` into an IdSet;
+            a failing page ends the walk with what was read so far.
+        '''
+        cursor = Cursor(self._limited(method, msg), cursor=0, **params)
+        ids = IdSetBuilder()
+        try:
+            for page in cursor.pages():
+                ids.extend(page.ids)
+        except WeibopError:
+            logger.info("WeibopError") 
+        return ids.build()
 
     @check_remain_requests('Too many requests in getLimitedFollowersIds')
     def getLimitedFollowersIds(self, cursor=-1, count=20):
@@ -307,77 +436,59 @@ class SinaAPI(object):
         uid=None,
         screen_name=None,
         count=200,
-        trim_status=0
+        trim_status=0,
+        fields=None,
     ):
         logger.info('api-nail')
-        cursor = -1
+        cursor = Cursor(
+            self._limited(self.api.friends, 'Too many requests in getFriends'),
+            uid=uid,
+            cursor=-1,
+            count=count,
+            trim_status=trim_status,
+            fields=fields,
+        )
         rvl=[]
-        for i in range(0,SINAAPI_FOLLOWERS_MAX_PAGE):        
-            self._testResetTime()
-            if self.request_limit < 1:
-                logger.info("TooManyRequests") 
-                #raise TooManyRequests('Too many requests in getFriends')
-                return rvl
-            self.request_limit -= 1
-            try:
-                status = self.api.friends(
-                    uid=uid,
-                    cursor=cursor,
-                    count=count,
-                    trim_status=trim_status,
-                )
-            except WeibopError:
-                logger.info("WeibopError") 
-                return rvl
-            if len(status) == 0:
-                break;
-            else:
-                cursor += len(status)
-                rvl.extend(status)
+        try:
+            for page in cursor.pages(SINAAPI_FOLLOWERS_MAX_PAGE):
+                rvl.extend(page)
+        except TooManyRequests:
+            logger.info("TooManyRequests") 
+        except WeibopError:
+            logger.info("WeibopError") 
         return rvl
 
     def getFriendsIds(self, uid=None, screen_name=None, count=200):
+        return list(self.getFriendsIdSet(uid, screen_name, count))
+
+    def getFriendsIdSet(self, uid=None, screen_name=None, count=200):
+        '''
+            the ids of everyone `uid` (or `screen_name`) follows as an
+            IdSet.
+        '''
         logger.info('api-nail')
-        cursor = 0
-        rvl=[]
-        while True:
-            self._testResetTime()
-            if self.request_limit < 1:
-                raise TooManyRequests('Too many requests in getFriendsIds')
-            self.request_limit -= 1
-            try:
-                status = self.api.friends_ids(
-                    uid=uid,
-                    cursor=cursor,
-                    count=count,
-                )
-            except WeibopError:
-                logger.info("WeibopError") 
-                return rvl
-            if len(status.ids) == 0:
-                break;
-            else:
-                cursor += len(status.ids)
-                rvl.extend(status.ids)
-        return rvl
+        return self._collectIdSet(
+            self.api.friends_ids, 'Too many requests in getFriendsIdSet',
+            uid=uid, screen_name=screen_name, count=count)
 
     
     @check_remain_requests('Too many requests in getUserTimeline')
-    def getUserTimeline(self, uid=None, since_id=None, count=200, page=1):
+    def getUserTimeline(self, uid=None, since_id=None, count=200, page=1, fields=None):
         logger.info('api-nail')
         if uid is None and since_id is None:
-            return self.api.user_timeline(count=count, page=page)
+            return self.api.user_timeline(count=count, page=page, fields=fields)
         else:
-            return self.api.user_timeline(uid=uid, since_id=since_id, count=count, page=page)
+            return self.api.user_timeline(uid=uid, since_id=since_id, count=count, page=page, fields=fields)
 
 
     @check_remain_requests('Too many requests in getUserTimeline')
-    def getPublicTimeline(self, since_id=None, count=200, page=1):
+    def getPublicTimeline(self, since_id=None, count=200, page=1, fields=None):
         logger.info('api-nail')
         return self.api.public_timeline(
             since_id=since_id,
             count=count,
             page=page,
+            fields=fields,
         )
 
 
@@ -401,6 +512,7 @@ class SinaAPI(object):
         count=200,
         page=1,
         filter_by_author=0,
+        fields=None,
     ):
         logger.info('api-nail')
         return self.api.repost_timeline(
@@ -410,12 +522,13 @@ class SinaAPI(object):
             count=count,
             page=page,
             filter_by_author=filter_by_author,
+            fields=fields,
         )
 
     @check_remain_requests('Too many requests in getCommentsToMe')
-    def getCommentsToMe(self, since_id, count=200, page=1):
+    def getCommentsToMe(self, since_id, count=200, page=1, fields=None):
         logger.info('api-nail')
-        return self.api.comments_to_me(since_id=since_id, count=count, page=page)
+        return self.api.comments_to_me(since_id=since_id, count=count, page=page, fields=fields)
 
     @check_remain_requests('Too many requests in getCommentsToMe')
     def getCommentsShow(
@@ -426,6 +539,7 @@ class SinaAPI(object):
         count=200,
         page=1,
         filter_by_author=0,
+        fields=None,
     ):
         logger.info('api-nail')
         if count > 200:
@@ -438,6 +552,7 @@ class SinaAPI(object):
             count=count,
             page=page,
             filter_by_author=filter_by_author,
+            fields=fields,
         )
 
 
@@ -466,9 +581,9 @@ class SinaAPI(object):
         return self.api.users_count(uids=uids)
 
     @check_remain_requests('Too many requests in getCommentsToMe')
-    def getCommentsByMe(self, since_id, count=200, page=1):
+    def getCommentsByMe(self, since_id, count=200, page=1, fields=None):
         logger.info('api-nail')
-        return self.api.comments_by_me(since_id=since_id, count=count, page=page)
+        return self.api.comments_by_me(since_id=since_id, count=count, page=page, fields=fields)
 
     @check_remain_requests('Too many requests in getComments')
     def getUnread(self):
@@ -482,14 +597,14 @@ class SinaAPI(object):
         return self.api.emotions()
 
     @check_remain_requests('Too many requests in getComments')
-    def getComments(self, status_id, count=200, page=1):
+    def getComments(self, status_id, count=200, page=1, fields=None):
         logger.info('api-nail')
-        return self.api.comments(status_id, count=count, page=page)
+        return self.api.comments(status_id, count=count, page=page, fields=fields)
 
     @check_remain_requests('Too many requests in getComments')
-    def getMentions(self, since_id, count=200, page=1):
+    def getMentions(self, since_id, count=200, page=1, fields=None):
         logger.info('api-nail')
-        return self.api.mentions(since_id=since_id, count=count, page=page)
+        return self.api.mentions(since_id=since_id, count=count, page=page, fields=fields)
 
 
     @check_remain_requests('Too many requests in getLimitedFriendsIds')
@@ -499,15 +614,15 @@ class SinaAPI(object):
         return {'ids':status.ids, 'next_cursor':status.next_cursor}
     
     @check_remain_requests('Too many requests in getUser')
-    def getUser(self,user_id):
+    def getUser(self,user_id, fields=None):
         #logger.info('api-nail')
-        status = self.api.get_user(uid=user_id)
+        status = self.api.get_user(uid=user_id, fields=fields)
         return status
 
     @check_remain_requests('Too many requests in getUser')
-    def getUserByName(self, screen_name=None):
+    def getUserByName(self, screen_name=None, fields=None):
         logger.info('api-nail')
-        userInfo = self.api.get_user(screen_name=screen_name)
+        userInfo = self.api.get_user(screen_name=screen_name, fields=fields)
         return userInfo
 
     @check_remain_requests('Too many requests in sendMessage')
@@ -598,19 +713,20 @@ class SinaAPI(object):
 
 
     @check_remain_requests('Too many requests in destoryFriendship')
-    def getTrendsStatus(self, trend, province=0, count=200, page=1):
+    def getTrendsStatus(self, trend, province=0, count=200, page=1, fields=None):
         status = self.api.trends_statuses(
             trend=trend,
             count=count, 
-            page=page
+            page=page,
+            fields=fields,
         )
         return status
 
 
     @check_remain_requests('Too many requests in destoryFriendship')
-    def ShowStatus(self, sid):
+    def ShowStatus(self, sid, fields=None):
         logger.info('api-nail')
-        return self.api.statuses_show(id=sid)
+        return self.api.statuses_show(id=sid, fields=fields)
 
 
     def getSearchStatus(self, q, since_id=-1):
@@ -0,0 +1,275 @@
+# coding=utf8
+
+'''
+    incremental sync of timelines with persisted since_id watermarks
+'''
+import json
+import os
+import sqlite3
+import threading
+
+from cursor import page_items
+from error import WeibopError
+from models import ResultSet
+
+# stream name -> API method
+STREAMS = {
+    'mentions': 'mentions',
+    'comments_to_me': 'comments_to_me',
+    'comments_by_me': 'comments_by_me',
+    'direct_messages': 'direct_messages',
+    'user_timeline': 'user_timeline',
+}
+
+
+class WatermarkStore(object):
+    '''
+        where SyncEngine keeps its watermark per (account, stream): the
+        tuple (since_id, max_id, newest_id). since_id is the newest id
+        delivered, max_id and newest_id are None. after a truncated poll
+        they describe the gap still to fetch instead: the ids above
+        since_id up to max_id; newest_id is the watermark once it is done.
+    '''
+
+    def get(self, account, stream):
+        '''
+            the stored watermark, or None if the stream was never synced.
+        '''
+        raise NotImplementedError
+
+    def set(self, account, stream, since_id, max_id=None, newest_id=None):
+        raise NotImplementedError
+
+    def delete(self, account, stream):
+        raise NotImplementedError
+
+
+class MemoryStore(WatermarkStore):
+    '''
+        watermarks that live as long as the process, mostly for tests.
+    '''
+
+    def __init__(self):
+        self._marks = {}
+        self._lock = threading.Lock()
+
+    def get(self, account, stream):
+        with self._lock:
+            return self._marks.get((account, stream))
+
+    def set(self, account, stream, since_id, max_id=None, newest_id=None):
+        with self._lock:
+            self._marks[(account, stream)] = (since_id, max_id, newest_id)
+
+    def delete(self, account, stream):
+        with self._lock:
+            self._marks.pop((account, stream), None)
+
+
+class FileStore(WatermarkStore):
+    '''
+        watermarks in a JSON file, rewritten atomically on every change.
+        fine for a few thousand accounts in one process; use SQLiteStore
+        beyond that or when several processes share the marks.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._marks = {}
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            try:
+                self._marks = json.load(f)
+            finally:
+                f.close()
+
+    def _key(self, account, stream):
+        return '%s/%s' % (account, stream)
+
+    def _save(self):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            json.dump(self._marks, f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        os.rename(tmp, self.path)
+
+    def get(self, account, stream):
+        with self._lock:
+            mark = self._marks.get(self._key(account, stream))
+        if mark is None:
+            return None
+        if not isinstance(mark, list):
+            # written before gaps were kept
+            return (mark, None, None)
+        return tuple(mark)
+
+    def set(self, account, stream, since_id, max_id=None, newest_id=None):
+        with self._lock:
+            self._marks[self._key(account, stream)] = [
+                since_id, max_id, newest_id]
+            self._save()
+
+    def delete(self, account, stream):
+        with self._lock:
+            if self._marks.pop(self._key(account, stream), None) is not None:
+                self._save()
+
+
+class SQLiteStore(WatermarkStore):
+    '''
+        watermarks in an SQLite table, safe to share between threads and
+        processes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS watermarks ('
+                'account TEXT NOT NULL, stream TEXT NOT NULL, '
+                'since_id INTEGER NOT NULL, max_id INTEGER, '
+                'newest_id INTEGER, PRIMARY KEY (account, stream))')
+            columns = [row[1] for row in
+                       self._db.execute('PRAGMA table_info(watermarks)')]
+            # tables created before gaps were kept
+            for column in ('max_id', 'newest_id'):
+                if column not in columns:
+                    self._db.execute(
+                        'ALTER TABLE watermarks ADD COLUMN %s INTEGER'
+                        % column)
+
+    def get(self, account, stream):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT since_id, max_id, newest_id FROM watermarks '
+                'WHERE account = ? AND stream = ?',
+                (str(account), stream)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, account, stream, since_id, max_id=None, newest_id=None):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO watermarks '
+                    '(account, stream, since_id, max_id, newest_id) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (str(account), stream, since_id, max_id, newest_id))
+
+    def delete(self, account, stream):
+        with self._lock:
+            with self._db:
+                self._db.execute(
+                    'DELETE FROM watermarks WHERE account = ? AND stream = ?',
+                    (str(account), stream))
+
+    def close(self):
+        self._db.close()
+
+
+def stream_method(api, stream):
+    '''
+        the call of `api` that reads `stream`.
+    '''
+    try:
+        return getattr(api, STREAMS[stream])
+    except KeyError:
+        raise WeibopError('Unknown sync stream: %s' % stream)
+
+
+def _item_id(item):
+    if isinstance(item, dict):
+        return int(item['id'])
+    return int(item.id)
+
+
+class SyncEngine(object):
+    '''
+        fetch only what is new on a stream since the last poll.
+
+        the newest id returned by a poll is stored as the stream's
+        watermark and passed as since_id next time. when more than `count`
+        items arrived in between, older pages are walked with max_id until
+        the watermark is reached, so nothing is skipped; items are
+        returned newest first, each once. the store is only written after
+        a poll, so a failed poll is simply repeated.
+
+        a stream without a watermark returns its `initial_pages` most
+        recent pages (all of them if None) and starts tracking from there.
+        `max_pages` bounds the requests of one poll; when it is hit the
+        result's `truncated` is True and the rest of the gap is stored.
+        the next polls fetch that rest first, older than what was already
+        returned, and only then move on to newer items.
+    '''
+
+    def __init__(self, store, count=200, initial_pages=1, max_pages=50):
+        self.store = store
+        self.count = count
+        self.initial_pages = initial_pages
+        self.max_pages = max_pages
+
+    def poll(self, api, account, stream, **params):
+        '''
+            the new items of `stream` (a key of STREAMS) for `account`,
+            read through `api`.
+        '''
+        return self.fetch(
+            stream_method(api, stream), account, stream, **params)
+
+    def fetch(self, method, account, stream, **params):
+        '''
+            like poll, with the api call given directly. `method` must
+            accept since_id, max_id and count. returns a ResultSet.
+        '''
+        since_id = max_id = newest_id = None
+        mark = self.store.get(account, stream)
+        if mark is not None:
+            since_id, max_id, newest_id = mark
+        if since_id is None:
+            max_pages = self.initial_pages
+        else:
+            max_pages = self.max_pages
+        params['count'] = self.count
+        if since_id is not None:
+            params['since_id'] = since_id
+        if max_id is not None:
+            # the rest of a gap a truncated poll left
+            params['max_id'] = max_id
+
+        items = ResultSet()
+        items.truncated = False
+        pages = 0
+        while True:
+            page = page_items(method(**params))
+            pages += 1
+            # since_id is exclusive and max_id inclusive on the server,
+            # but do not rely on either
+            new = [i for i in page if since_id is None or _item_id(i) > since_id]
+            if 'max_id' in params:
+                new = [i for i in new if _item_id(i) <= params['max_id']]
+            items.extend(new)
+            if len(page) < self.count or len(new) < len(page):
+                break
+            params['max_id'] = min(_item_id(i) for i in page) - 1
+            if max_pages is not None and pages >= max_pages:
+                items.truncated = since_id is not None
+                break
+
+        if newest_id is None and items:
+            newest_id = max(_item_id(i) for i in items)
+        elif since_id is None and newest_id is None:
+            # an empty stream: track it from the start, or the next poll
+            # would be a first one again and skip older items
+            newest_id = 0
+        if items.truncated:
+            self.store.set(
+                account, stream, since_id, params['max_id'], newest_id)
+        elif newest_id is not None:
+            self.store.set(account, stream, newest_id)
+        return items
@@ -0,0 +1,65 @@
+# coding=utf8
+'''
+    microbenchmark: utils.parse_datetime / parse_search_datetime against
+    plain time.strptime.
+
+    python tests/bench_datetime.py [count]
+'''
+import sys
+import time
+from datetime import datetime
+from datetime import timedelta
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+import utils
+from utils import parse_datetime
+from utils import parse_search_datetime
+
+
+def strptime_datetime(value):
+    return datetime(*(time.strptime(value, '%a %b %d %H:%M:%S +0800 %Y')[0:6]))
+
+
+def strptime_search_datetime(value):
+    return datetime(*(time.strptime(value, '%a %b %d %H:%M:%S +%f %Y')[0:6]))
+
+
+def timeit(fn, values):
+    start = time.time()
+    for v in values:
+        fn(v)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    start = datetime(2012, 1, 1)
+    # every value distinct: no memo hits
+    unique = [
+        (start + timedelta(seconds=37 * i)).strftime('%a %b %d %H:%M:%S +0800 %Y')
+        for i in range(count)
+    ]
+    # a timeline page: the same author created_at repeated
+    repeated = [unique[i % 200] for i in range(count)]
+
+    for a, b in zip(unique[:1000], unique[:1000]):
+        assert parse_datetime(a) == strptime_datetime(b)
+        assert parse_search_datetime(a) == strptime_search_datetime(b)
+
+    print '%d timestamps' % count
+    for name, values in (('unique', unique), ('repeated', repeated)):
+        base = timeit(strptime_datetime, values)
+        utils._datetime_memo.clear()
+        fast = timeit(parse_datetime, values)
+        utils._search_datetime_memo.clear()
+        search = timeit(parse_search_datetime, values)
+        print '%-8s strptime %.2fs  parse_datetime %.2fs (x%.1f)  ' \
+            'parse_search_datetime %.2fs (x%.1f)' % (
+                name, base, fast, base / fast, search, base / search)
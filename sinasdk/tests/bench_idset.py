@@ -0,0 +1,89 @@
+# coding=utf8
+'''
+    benchmark: follower ids collected the old way (list + list(set()))
+    against idset.IdSetBuilder, plus set operations and a memory-mapped
+    reload.
+
+    python tests/bench_idset.py [count]
+'''
+import os
+import random
+import sys
+import tempfile
+import time
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from idset import IdSet
+from idset import IdSetBuilder
+
+
+def pages(ids, size=2000):
+    for i in xrange(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def collect_list(ids):
+    rvl = []
+    for page in pages(ids):
+        rvl.extend(page)
+    return list(set(rvl))
+
+
+def collect_idset(ids):
+    builder = IdSetBuilder()
+    for page in pages(ids):
+        builder.extend(page)
+    return builder.build()
+
+
+def list_bytes(values):
+    # the list's pointer array plus one int object per id
+    return sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    random.seed(0)
+    ids = [random.randrange(1, 6 * 10 ** 9) for i in xrange(count)]
+    other = IdSet(ids[:count // 2] + [random.randrange(1, 6 * 10 ** 9)
+                                      for i in xrange(count // 2)])
+
+    start = time.time()
+    old = collect_list(ids)
+    old_time = time.time() - start
+    start = time.time()
+    new = collect_idset(ids)
+    new_time = time.time() - start
+    assert list(new) == sorted(old)
+
+    print '%d ids' % count
+    print 'list+set  %.2fs  %6.1f MB' % (old_time, list_bytes(old) / 1e6)
+    print 'IdSet     %.2fs  %6.1f MB' % (new_time, len(new) * 8 / 1e6)
+
+    probes = ids[:100000]
+    start = time.time()
+    assert all(i in new for i in probes)
+    print 'membership  %.2f us/lookup' % (
+        (time.time() - start) / len(probes) * 1e6)
+    for name, fn in (('union', new.union),
+                     ('intersection', new.intersection),
+                     ('difference', new.difference)):
+        start = time.time()
+        fn(other)
+        print '%-12s %.2fs' % (name, time.time() - start)
+
+    path = os.path.join(tempfile.mkdtemp(), 'followers.ids')
+    new.save(path)
+    start = time.time()
+    mapped = IdSet.load(path)
+    assert all(i in mapped for i in probes[:1000])
+    print 'mmap load + 1000 lookups %.3fs' % (time.time() - start)
+    mapped.close()
+    os.remove(path)
@@ -0,0 +1,60 @@
+# coding=utf8
+'''
+    benchmark the installed json backends on realistic payloads: a 200
+    status timeline, a 5000 follower id page and a 200 comment page.
+
+    python tests/bench_json.py [rounds]
+'''
+import sys
+import time
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+sys.path.insert(0, realpath(dirname(__file__)))
+
+from utils import available_json_backends
+from utils import import_json_backend
+from bench_models import make_status
+
+
+def make_payloads():
+    json = import_json_backend('json')
+    statuses = [make_status(i) for i in range(200)]
+    comments = [
+        {
+            'created_at': 'Wed Jun 01 00:50:25 +0800 2011',
+            'id': 12438492184 + i,
+            'text': u'love your work.......',
+            'source': '<a href="http://weibo.com" rel="nofollow">新浪微博</a>',
+            'mid': '202110601896455629',
+            'user': statuses[i]['user'],
+            'status': statuses[i],
+        }
+        for i in range(200)
+    ]
+    ids = range(1000000000, 1000000000 + 5000 * 7919, 7919)
+    return [
+        ('timeline', json.dumps({'statuses': statuses, 'total_number': 200})),
+        ('follower ids', json.dumps({'ids': ids, 'next_cursor': 5000})),
+        ('comments', json.dumps({'comments': comments, 'total_number': 200})),
+    ]
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    payloads = make_payloads()
+    print 'backends: %s' % ', '.join(available_json_backends())
+    for label, raw in payloads:
+        print '%s (%d KB, %d rounds)' % (label, len(raw) / 1024, rounds)
+        for name in available_json_backends():
+            backend = import_json_backend(name)
+            start = time.time()
+            for i in range(rounds):
+                backend.loads(raw)
+            elapsed = time.time() - start
+            print '    %-12s %7.2f ms/page' % (name, elapsed * 1000 / rounds)
@@ -0,0 +1,121 @@
+# coding=utf8
+'''
+    memory/speed benchmark: regular models vs the __slots__ based and the
+    lazy ones.
+
+    python tests/bench_models.py [count]
+'''
+import sys
+import time
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from models import Status
+from models import CompactStatus
+from models import LazyStatus
+from utils import import_simplejson
+
+
+def make_status(i):
+    return {
+        'created_at': 'Tue May 31 17:46:55 +0800 2011',
+        'id': 11488058246 + i,
+        'mid': '5612814510546515491',
+        'idstr': str(11488058246 + i),
+        'text': u'求关注。',
+        'source': '<a href="http://weibo.com" rel="nofollow">新浪微博</a>',
+        'favorited': False,
+        'truncated': False,
+        'in_reply_to_status_id': '',
+        'in_reply_to_user_id': '',
+        'in_reply_to_screen_name': '',
+        'geo': None,
+        'reposts_count': 8,
+        'comments_count': 9,
+        'attitudes_count': 0,
+        'mlevel': 0,
+        'visible': {'type': 0, 'list_id': 0},
+        'user': {
+            'id': 1404376560 + i % 50,
+            'screen_name': 'zaku',
+            'name': 'zaku',
+            'province': '11',
+            'city': '5',
+            'location': u'北京 朝阳区',
+            'description': u'人生五十年，乃如梦如幻；有生斯有死，壮士复何憾。',
+            'url': 'http://blog.sina.com.cn/zaku',
+            'profile_image_url': 'http://tp1.sinaimg.cn/1404376560/50/0/1',
+            'domain': 'zaku',
+            'gender': 'm',
+            'followers_count': 1204,
+            'friends_count': 447,
+            'statuses_count': 2908,
+            'favourites_count': 0,
+            'created_at': 'Fri Aug 28 00:00:00 +0800 2009',
+            'following': False,
+            'allow_all_act_msg': False,
+            'geo_enabled': True,
+            'verified': False,
+            'allow_all_comment': True,
+            'avatar_large': 'http://tp1.sinaimg.cn/1404376560/180/0/1',
+            'verified_reason': '',
+            'follow_me': False,
+            'online_status': 0,
+            'bi_followers_count': 215,
+        },
+    }
+
+
+def object_size(obj, seen):
+    '''
+        bytes held by a model object and its nested models. the field
+        values themselves come from the decoded json and are not counted.
+    '''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    attrs = getattr(obj, '__dict__', None)
+    if attrs is None:
+        attrs = dict(obj.__getstate__())
+        if obj._extra:
+            size += sys.getsizeof(obj._extra)
+    else:
+        size += sys.getsizeof(attrs)
+    for v in attrs.values():
+        if hasattr(v, '_api'):
+            size += object_size(v, seen)
+    return size
+
+
+def bench(model, payload):
+    start = time.time()
+    objs = model.parse_list(None, payload)
+    elapsed = time.time() - start
+    seen = set()
+    size = sum(object_size(o, seen) for o in objs)
+    return elapsed, size
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    payload = [make_status(i) for i in range(count)]
+
+    json = import_simplejson()
+    raw = json.dumps(payload)
+    start = time.time()
+    json.loads(raw)
+    print '%d statuses with nested users, json.loads %.2fs' % (
+        count, time.time() - start)
+    base = None
+    for model in (Status, CompactStatus, LazyStatus):
+        elapsed, size = bench(model, payload)
+        base = base or size
+        print '%-14s parse %6.2fs  object memory %8.1f MB  (%.0f%%)' % (
+            model.__name__, elapsed, size / 1048576.0, 100.0 * size / base)
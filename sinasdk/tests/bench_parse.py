@@ -0,0 +1,146 @@
+# coding=utf8
+'''
+    benchmark: compiled Status/Comments parsers against the previous
+    if/elif parsers, on 200 item pages.
+
+    python tests/bench_parse.py [pages]
+'''
+import sys
+import time
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+sys.path.insert(0, realpath(dirname(__file__)))
+
+from models import Model
+from models import Status
+from models import Comments
+from models import Geo
+from utils import import_simplejson
+from utils import parse_datetime
+from utils import parse_html_value
+from utils import parse_a_href
+from bench_models import make_status
+
+
+class LegacyUser(Model):
+
+    @classmethod
+    def parse(cls, api, json):
+        user = cls(api)
+        for k, v in json.items():
+            if k == 'created_at':
+                setattr(user, k, parse_datetime(v))
+            elif k == 'status':
+                setattr(user, k, LegacyStatus.parse(api, v))
+            elif k == 'screen_name':
+                setattr(user, k, v)
+            elif k == 'following':
+                if v is True:
+                    setattr(user, k, True)
+                else:
+                    setattr(user, k, False)
+            else:
+                setattr(user, k, v)
+        return user
+
+
+class LegacyStatus(Model):
+
+    @classmethod
+    def parse(cls, api, json):
+        status = cls(api)
+        for k, v in json.items():
+            if k == 'user':
+                user = LegacyUser.parse(api, v)
+                setattr(status, 'author', user)
+                setattr(status, 'user', user)
+            elif k == 'screen_name':
+                setattr(status, k, v)
+            elif k == 'created_at':
+                if v:
+                    setattr(status, k, parse_datetime(v))
+                else:
+                    setattr(status, k, None)
+            elif k == 'source':
+                if '<' in v:
+                    setattr(status, k, parse_html_value(v))
+                    setattr(status, 'source_url', parse_a_href(v))
+                else:
+                    setattr(status, k, v)
+            elif k == 'retweeted_status':
+                setattr(status, k, LegacyStatus.parse(api, v))
+            elif k == 'geo':
+                setattr(status, k, Geo.parse(api, v))
+            else:
+                setattr(status, k, v)
+        return status
+
+
+class LegacyComments(Model):
+
+    @classmethod
+    def parse(cls, api, json):
+        comments = cls(api)
+        for k, v in json.items():
+            if k == 'user':
+                user = LegacyUser.parse(api, v)
+                setattr(comments, 'author', user)
+                setattr(comments, 'user', user)
+            elif k == 'status':
+                setattr(comments, k, LegacyStatus.parse(api, v))
+            elif k == 'created_at' and v:
+                setattr(comments, k, parse_datetime(v))
+            elif k == 'reply_comment':
+                setattr(comments, k, LegacyComments.parse(api, v))
+            else:
+                setattr(comments, k, v)
+        return comments
+
+
+def make_comment(i):
+    status = make_status(i)
+    return {
+        'created_at': 'Wed Jun 01 00:50:25 +0800 2011',
+        'id': 12438492184 + i,
+        'text': u'love your work.......',
+        'source': '<a href="http://weibo.com" rel="nofollow">新浪微博</a>',
+        'mid': '202110601896455629',
+        'user': status['user'],
+        'status': status,
+    }
+
+
+def bench(model, pages):
+    start = time.time()
+    for page in pages:
+        model.parse_list(None, page)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    json = import_simplejson()
+    # decode every page separately, as the parser would
+    status_pages = [
+        json.loads(json.dumps([make_status(i) for i in range(200)]))
+        for p in range(count)
+    ]
+    comment_pages = [
+        json.loads(json.dumps([make_comment(i) for i in range(200)]))
+        for p in range(count)
+    ]
+
+    print '%d pages of 200 items' % count
+    for label, legacy, compiled, pages in (
+            ('status', LegacyStatus, Status, status_pages),
+            ('comments', LegacyComments, Comments, comment_pages)):
+        old = bench(legacy, pages)
+        new = bench(compiled, pages)
+        print '%-9s if/elif %.3fs  compiled %.3fs  (x%.1f)' % (
+            label, old, new, old / new)
@@ -0,0 +1,53 @@
+# coding=utf8
+'''
+    benchmark: serialize.dumps/loads against cPickle protocol 2 on a batch
+    of statuses with nested users.
+
+    python tests/bench_serialize.py [count] [rounds]
+'''
+import sys
+import time
+import cPickle
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+sys.path.insert(0, realpath(dirname(__file__)))
+
+import serialize
+from models import Status
+from utils import import_simplejson
+from bench_models import make_status
+
+
+def timeit(fn, rounds):
+    start = time.time()
+    for i in range(rounds):
+        result = fn()
+    return (time.time() - start) / rounds, result
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    json = import_simplejson()
+    statuses = Status.parse_list(
+        None, json.loads(json.dumps([make_status(i) for i in range(count)])))
+
+    pickle_dumps, pickled = timeit(
+        lambda: cPickle.dumps(statuses, 2), rounds)
+    pickle_loads, _ = timeit(lambda: cPickle.loads(pickled), rounds)
+    dumps, encoded = timeit(lambda: serialize.dumps(statuses), rounds)
+    loads, decoded = timeit(lambda: serialize.loads(encoded), rounds)
+    assert decoded[0].author.screen_name == statuses[0].author.screen_name
+
+    print '%d statuses, %d rounds' % (count, rounds)
+    print '%-10s %8s %10s %10s' % ('', 'bytes', 'dumps ms', 'loads ms')
+    print '%-10s %8d %10.2f %10.2f' % (
+        'pickle 2', len(pickled), pickle_dumps * 1000, pickle_loads * 1000)
+    print '%-10s %8d %10.2f %10.2f' % (
+        'serialize', len(encoded), dumps * 1000, loads * 1000)
@@ -0,0 +1,122 @@
+# coding=utf8
+'''
+    check: CrawlJob resumes to exactly the items of an uninterrupted crawl
+    after injected request failures, paused runs and crashes that leave
+    pages in the item log past the last checkpoint.
+
+    python tests/check_crawl.py [rounds] [seed]
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from crawl import CrawlJob
+from error import WeibopError
+
+
+class FakeAPI(object):
+    '''
+        a cursor-mode ids endpoint and a page-mode list endpoint over
+        fixed data, failing every request with probability `failure`.
+    '''
+
+    def __init__(self, rng, total, failure):
+        self.rng = rng
+        self.ids = range(total)
+        self.failure = failure
+        self.requests = 0
+
+        def followers_ids(cursor=0, count=50, uid=None):
+            self._request()
+            page = self.ids[cursor:cursor + count]
+            following = cursor + len(page)
+            if following >= len(self.ids):
+                following = 0
+            return {'ids': page, 'next_cursor': following}
+        followers_ids.pagination_mode = 'cursor'
+
+        def direct_messages(page=1, count=50):
+            self._request()
+            start = (page - 1) * count
+            return [{'id': i, 'text': u'消息 %d' % i}
+                    for i in self.ids[start:start + count]]
+        direct_messages.pagination_mode = 'page'
+
+        self.followers_ids = followers_ids
+        self.direct_messages = direct_messages
+
+    def _request(self):
+        self.requests += 1
+        if self.rng.random() < self.failure:
+            raise WeibopError('injected failure')
+
+
+def crawl(api, method_name, path, rng, **params):
+    '''
+        run the crawl to the end through failures, pauses and crashes.
+    '''
+    for attempt in xrange(10000):
+        job = CrawlJob(api, method_name, path, every=rng.randint(1, 4),
+                       **params)
+        if job.done:
+            return job.run()
+        if rng.random() < 0.3 and os.path.exists(path):
+            # crash: the checkpoint is rolled back to this one while the
+            # pages fetched meanwhile stay in the log
+            saved = path + '.saved'
+            shutil.copy(path, saved)
+            try:
+                job.run(limit=rng.randint(1, 5))
+            except WeibopError:
+                pass
+            os.rename(saved, path)
+            continue
+        try:
+            job.run(limit=rng.choice((None, rng.randint(1, 5))))
+        except WeibopError:
+            pass
+    raise AssertionError('crawl did not finish')
+
+
+def check(rng, directory):
+    total = rng.randint(0, 600)
+    count = rng.randint(1, 60)
+    api = FakeAPI(rng, total, failure=0.2)
+
+    path = os.path.join(directory, 'ids.crawl')
+    ids = crawl(api, 'followers_ids', path, rng, uid=1, count=count)
+    assert ids == range(total), (total, count, len(ids))
+
+    path = os.path.join(directory, 'dm.crawl')
+    messages = crawl(api, 'direct_messages', path, rng, count=count)
+    assert [m['id'] for m in messages] == range(total), (total, count)
+    assert all(m['text'] == u'消息 %d' % m['id'] for m in messages)
+
+    # a finished crawl answers from its files
+    requests = api.requests
+    assert CrawlJob(api, 'direct_messages', path, count=count).run() \
+        == messages
+    assert api.requests == requests
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = random.Random(seed)
+    for i in xrange(rounds):
+        directory = tempfile.mkdtemp()
+        try:
+            check(rng, directory)
+        finally:
+            shutil.rmtree(directory)
+    print 'ok: %d crawls resumed through failures and crashes' % rounds
@@ -0,0 +1,92 @@
+# coding=utf8
+'''
+    check: parser.iter_json_array against json.loads on random documents,
+    read in random chunk sizes. strings are full of brackets, commas,
+    quotes and escapes, and the list sits either at the top level or
+    under a list key between other keys.
+
+    python tests/check_json_stream.py [documents] [seed]
+'''
+import json
+import random
+import sys
+from StringIO import StringIO
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from parser import LIST_KEYS
+from parser import iter_json_array
+
+ALPHABET = u'ab ,:[]{}"\\/\n\t微博\U0001f600'
+
+
+def random_string(rng):
+    return u''.join(rng.choice(ALPHABET) for i in xrange(rng.randint(0, 8)))
+
+
+def random_value(rng, depth=0):
+    kind = rng.randint(0, 7 if depth < 3 else 4)
+    if kind == 0:
+        return None
+    if kind == 1:
+        return rng.choice((True, False))
+    if kind == 2:
+        return rng.randint(-2 ** 63, 2 ** 63 - 1)
+    if kind == 3:
+        return rng.uniform(-1e6, 1e6)
+    if kind == 4:
+        return random_string(rng)
+    if kind == 5:
+        return [random_value(rng, depth + 1)
+                for i in xrange(rng.randint(0, 4))]
+    return dict((random_string(rng), random_value(rng, depth + 1))
+                for i in xrange(rng.randint(0, 4)))
+
+
+def random_document(rng):
+    '''
+        (json text, the list iter_json_array should yield)
+    '''
+    items = [random_value(rng) for i in xrange(rng.randint(0, 6))]
+    if rng.random() < 0.3:
+        document = items
+    else:
+        document = {}
+        # other keys, also holding lists, around the list key; not list
+        # keys themselves, the first list key found wins
+        for i in xrange(rng.randint(0, 3)):
+            key = random_string(rng)
+            if key not in LIST_KEYS:
+                document[key] = random_value(rng)
+        document[rng.choice(LIST_KEYS)] = items
+    text = json.dumps(
+        document,
+        ensure_ascii=rng.random() < 0.5,
+        indent=rng.choice((None, 0, 2)),
+        separators=rng.choice(((',', ':'), (', ', ': '))),
+    )
+    if isinstance(text, unicode):
+        text = text.encode('utf8')
+    return text, items
+
+
+def check(rng):
+    text, expected = random_document(rng)
+    chunk_size = rng.choice((1, 2, 3, rng.randint(1, 64), len(text) + 1))
+    got = list(iter_json_array(StringIO(text), json.loads, chunk_size))
+    assert got == expected, (text, chunk_size, got)
+
+
+if __name__ == '__main__':
+    documents = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = random.Random(seed)
+    for i in xrange(documents):
+        check(rng)
+    print 'ok: %d documents streamed as json.loads reads them' % documents
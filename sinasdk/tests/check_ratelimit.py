@@ -0,0 +1,102 @@
+# coding=utf8
+'''
+    check: processes sharing one MmapBackend file draw from one bucket.
+    every process, and several threads in each, races for the tokens of
+    a bucket that does not refill in time; together they must get exactly
+    its capacity, and buckets with another key must stay untouched.
+
+    python tests/check_ratelimit.py [processes] [capacity]
+'''
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from ratelimit import MmapBackend
+from ratelimit import TokenBucket
+
+# long enough that the refill during a run is well below one token
+PERIOD = 10 ** 9
+THREADS = 4
+
+
+def slow_clock():
+    # the backend reads the clock between loading and storing a bucket:
+    # sleeping there lets unsynchronized updates overlap
+    time.sleep(0.00005)
+    return time.time()
+
+
+def drain(path, capacity, attempts, start, results):
+    '''
+        take tokens from a fresh backend on `path` in a few threads and
+        report how many were granted.
+    '''
+    backend = MmapBackend(path, clock=slow_clock)
+    bucket = TokenBucket(capacity, PERIOD, backend=backend, key='app')
+    granted = [0] * THREADS
+
+    def run(i):
+        for n in xrange(attempts):
+            if bucket.acquire():
+                granted[i] += 1
+
+    start.wait()
+    threads = [threading.Thread(target=run, args=(i, ))
+               for i in xrange(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    backend.close()
+    results.put(sum(granted))
+
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'buckets')
+        # created by the first process that opens it
+        MmapBackend(path).close()
+        # each process alone could empty the bucket
+        attempts = capacity // THREADS + 1
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=drain,
+                args=(path, capacity, attempts, start, results))
+            for i in xrange(processes)
+        ]
+        for p in workers:
+            p.start()
+        start.set()
+        granted = [results.get() for p in workers]
+        for p in workers:
+            p.join()
+            assert p.exitcode == 0, p.exitcode
+
+        assert sum(granted) == capacity, (granted, capacity)
+        backend = MmapBackend(path)
+        assert TokenBucket(capacity, PERIOD, backend=backend,
+                           key='app').remaining == 0
+        assert TokenBucket(capacity, PERIOD, backend=backend,
+                           key='token').remaining == capacity
+        backend.close()
+    finally:
+        shutil.rmtree(directory)
+    print 'ok: %d processes x %d threads shared %d tokens exactly %r' % (
+        processes, THREADS, capacity, granted)
@@ -0,0 +1,109 @@
+# coding=utf8
+'''
+    check: SyncEngine delivers every item of a stream exactly once across
+    randomized bursts, truncated polls (small max_pages) and failing
+    requests, with each WatermarkStore.
+
+    python tests/check_sync.py [rounds] [seed]
+'''
+import os
+import random
+import shutil
+import sys
+import tempfile
+from os.path import realpath, dirname
+from os.path import join as path_join
+sys.path.insert(
+    0,
+    realpath(
+        path_join(dirname(__file__), '../')
+    )
+)
+
+from error import WeibopError
+from sync import FileStore
+from sync import MemoryStore
+from sync import SQLiteStore
+from sync import SyncEngine
+
+
+class Timeline(object):
+    '''
+        a stream whose ids grow with random gaps, read newest first like
+        the weibo timelines. requests fail with probability `failure`.
+    '''
+
+    def __init__(self, rng, failure):
+        self.rng = rng
+        self.failure = failure
+        self.ids = []
+
+    def publish(self, n):
+        top = self.ids[-1] if self.ids else 0
+        for i in xrange(n):
+            top += self.rng.randint(1, 3)
+            self.ids.append(top)
+
+    def __call__(self, count, since_id=None, max_id=None):
+        if self.rng.random() < self.failure:
+            raise WeibopError('injected failure')
+        page = [{'id': i} for i in reversed(self.ids)
+                if (since_id is None or i > since_id) and
+                (max_id is None or i <= max_id)]
+        return page[:count]
+
+
+def check(rng, store):
+    timeline = Timeline(rng, failure=0.1)
+    engine = SyncEngine(
+        store, count=rng.randint(1, 10), max_pages=rng.randint(1, 3))
+    seen = []
+
+    def poll():
+        try:
+            items = engine.fetch(timeline, 'a', 'mentions')
+        except WeibopError:
+            return None
+        seen.extend(item['id'] for item in items)
+        return items
+
+    # start tracking on an empty stream, so every item is expected
+    while poll() is None:
+        pass
+    for step in xrange(rng.randint(1, 30)):
+        timeline.publish(rng.choice((0, 1, rng.randint(0, 60))))
+        poll()
+    # drain: keep polling until a poll without a pending gap is complete
+    # and brings nothing (the poll closing a gap may bring nothing too)
+    for i in xrange(10000):
+        mark = store.get('a', 'mentions')
+        items = poll()
+        if items is not None and not items and not items.truncated and \
+                (mark is None or mark[1] is None):
+            break
+    else:
+        raise AssertionError('sync did not catch up')
+
+    assert len(seen) == len(set(seen)), 'duplicates'
+    assert sorted(seen) == timeline.ids, 'missing %r' % (
+        sorted(set(timeline.ids) - set(seen))[:10])
+    assert store.get('a', 'mentions') == (
+        timeline.ids[-1] if timeline.ids else 0, None, None)
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = random.Random(seed)
+    directory = tempfile.mkdtemp()
+    try:
+        for i in xrange(rounds):
+            for store in (
+                    MemoryStore(),
+                    FileStore(os.path.join(directory, 'marks%d.json' % i)),
+                    SQLiteStore(os.path.join(directory, 'marks%d.db' % i))):
+                check(rng, store)
+    finally:
+        shutil.rmtree(directory)
+    print 'ok: %d randomized syncs per store, no duplicate or missing item' \
+        % rounds
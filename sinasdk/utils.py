@@ -1,6 +1,7 @@
 # Copyright 2010 Joshua Roesslein
 # See LICENSE for details.
 
+from array import array
 from datetime import datetime
 from error import WeibopError
 import urllib
@@ -9,10 +10,88 @@ import htmlentitydefs
 import re
 
 
+_MONTHS = dict(
+    (name, i + 1) for i, name in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+         'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')))
+_WEEKDAYS = frozenset(('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'))
+
+# parsed values of recently seen timestamps, cleared when full
+DATETIME_MEMO_SIZE = 4096
+_datetime_memo = {}
+_search_datetime_memo = {}
+
+
+def _parse_weibo_time(value, tz):
+    '''
+        parse 'Tue May 31 17:46:55 +0800 2011' without strptime. `tz` is
+        the offset that has to be present, or None to accept any '+NNNN'.
+        returns None if the value does not have exactly this shape.
+    '''
+    parts = value.split(' ')
+    if len(parts) != 6:
+        return None
+    wday, month, day, clock, offset, year = parts
+    if wday not in _WEEKDAYS or len(clock) != 8 or \
+            clock[2] != ':' or clock[5] != ':':
+        return None
+    if tz is None:
+        if offset[:1] != '+' or not offset[1:].isdigit():
+            return None
+    elif offset != tz:
+        return None
+    try:
+        return datetime(
+            int(year), _MONTHS[month], int(day),
+            int(clock[0:2]), int(clock[3:5]), int(clock[6:8]),
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def _memoize(memo, key, value):
+    if len(memo) >= DATETIME_MEMO_SIZE:
+        memo.clear()
+    memo[key] = value
+    return value
+
+
 def parse_datetime(str):
 
-    # We must parse datetime this way to work in python 2.4
-    return datetime(*(time.strptime(str, '%a %b %d %H:%M:%S +0800 %Y')[0:6]))
+    try:
+        return _datetime_memo[str]
+    except KeyError:
+        pass
+
+    value = _parse_weibo_time(str, '+0800')
+    if value is None:
+        # not the usual shape: let strptime parse it or raise its error
+        value = datetime(*(time.strptime(str, '%a %b %d %H:%M:%S +0800 %Y')[0:6]))
+    return _memoize(_datetime_memo, str, value)
+
+
+def _int64_typecode():
+    # 'q' is python 3 only, on 64-bit unix 'l' is 8 bytes wide
+    for code in ('q', 'l'):
+        try:
+            if array(code).itemsize == 8:
+                return code
+        except ValueError:
+            continue
+    return None
+
+# None on builds without one (windows, 32-bit): see require_int64
+INT64_TYPECODE = _int64_typecode()
+
+
+def require_int64():
+    '''
+        raise WeibopError unless int64 arrays are available. called by
+        the features that store ids in them, so the rest of the SDK
+        imports and works without.
+    '''
+    if INT64_TYPECODE is None:
+        raise WeibopError('No 64-bit integer array typecode on this platform')
 
 
 def parse_html_value(html):
@@ -29,9 +108,15 @@ def parse_a_href(atag):
 
 def parse_search_datetime(str):
 
-    # python 2.4
-    #return datetime(*(time.strptime(str, '%a, %d %b %Y %H:%M:%S +0000')[0:6]))
-    return datetime(*(time.strptime(str, '%a %b %d %H:%M:%S +%f %Y')[0:7]))
+    try:
+        return _search_datetime_memo[str]
+    except KeyError:
+        pass
+
+    value = _parse_weibo_time(str, None)
+    if value is None:
+        value = datetime(*(time.strptime(str, '%a %b %d %H:%M:%S +%f %Y')[0:6]))
+    return _memoize(_search_datetime_memo, str, value)
 
 
 def unescape_html(text):
@@ -82,6 +167,128 @@ def import_simplejson():
     return json
 
 
+class JsonBackend(object):
+    '''
+        a json implementation: `loads` and `dumps` plus its module name.
+    '''
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<JsonBackend %s>' % self.name
+
+
+# fastest first
+JSON_BACKENDS = ('orjson', 'ujson', 'yajl', 'simplejson', 'json')
+
+_json_backend = None
+
+
+def available_json_backends():
+    '''
+        names of the backends that can be imported here, fastest first.
+    '''
+    names = []
+    for name in JSON_BACKENDS:
+        try:
+            __import__(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def import_json_backend(name=None):
+    '''
+        return a JsonBackend. `name` picks a module from JSON_BACKENDS,
+        None picks the fastest one installed. a JsonBackend is returned
+        as is.
+    '''
+    if isinstance(name, JsonBackend):
+        return name
+    for candidate in (name, ) if name else JSON_BACKENDS:
+        try:
+            module = __import__(candidate)
+        except ImportError:
+            continue
+        return JsonBackend(candidate, module.loads, module.dumps)
+    if name:
+        raise ImportError, "Can't load json backend %s" % name
+    json = import_simplejson()
+    return JsonBackend(json.__name__, json.loads, json.dumps)
+
+
+def get_json_backend():
+    '''
+        the process wide default backend, detected on first use.
+    '''
+    global _json_backend
+    if _json_backend is None:
+        _json_backend = import_json_backend()
+    return _json_backend
+
+
+def set_json_backend(name):
+    '''
+        change the process wide default backend.
+    '''
+    global _json_backend
+    _json_backend = import_json_backend(name)
+    return _json_backend
+
+
+# names callers may use for a field that weibo sends under another key
+FIELD_ALIASES = {'author': 'user'}
+
+
+def compile_fields(fields):
+    '''
+        turn ['id', 'text', 'user.id'] into the tree
+        {'id': None, 'text': None, 'user': {'id': None}}; None means the
+        whole value is kept.
+    '''
+    if not fields:
+        return None
+    tree = {}
+    for field in fields:
+        node = tree
+        parts = field.split('.')
+        for i, part in enumerate(parts):
+            part = FIELD_ALIASES.get(part, part)
+            if i == len(parts) - 1:
+                node[part] = None
+                break
+            child = node.get(part, {})
+            if child is None:
+                # the whole value is already requested
+                break
+            node[part] = child
+            node = child
+    return tree
+
+
+def project_fields(json, tree):
+    '''
+        copy of the json object (or list of objects) that only has the
+        keys in `tree`.
+    '''
+    if isinstance(json, list):
+        return [project_fields(item, tree) for item in json]
+    if not isinstance(json, dict):
+        return json
+    projected = {}
+    for key, subtree in tree.iteritems():
+        if key not in json:
+            continue
+        value = json[key]
+        if subtree is not None:
+            value = project_fields(value, subtree)
+        projected[key] = value
+    return projected
+
+
 def build_parameters(*args, **kargs):
     parameters = {}
     for idx, arg in enumerate(args):